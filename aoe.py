@@ -0,0 +1,121 @@
+"""
+Area of effect templates: Blast, Burst, Cone and Line, in axial coordinates.
+
+    Blast N  every hex within N of the aimed hex
+    Burst N  every hex within N of the attacker's footprint, not the footprint itself
+    Cone N   N rows out from the attacker along the hex direction nearest the aim,
+             row k is k hexes wide, so the cone is N wide at the end
+    Line N   the first N hexes of the straight line from the attacker towards the aim
+
+Templates give hex sets; the tokens in them are looked up in the MapState hex
+index, so resolving a template only touches the hexes it covers.
+"""
+from grid import DIRECTIONS
+from map_state import FOOTPRINTS
+
+SINGLE = "Single"
+BLAST = "Blast"
+BURST = "Burst"
+CONE = "Cone"
+LINE = "Line"
+TEMPLATES = (SINGLE, BLAST, BURST, CONE, LINE)
+
+
+def blast_hexes(q, r, size):
+    return set(FOOTPRINTS.hex_range(q, r, size))
+
+
+def burst_hexes(q, r, size, origin_size=1):
+    footprint = FOOTPRINTS.footprint_hexes(q, r, origin_size)
+    hexes = set()
+    for fq, fr in footprint:
+        hexes.update(FOOTPRINTS.hex_range(fq, fr, size))
+    return hexes.difference(footprint)
+
+
+def cone_hexes(q, r, aim_q, aim_r, size):
+    # Angles don't depend on the grid's orientation or cell size
+    ax, ay = FOOTPRINTS.hex_to_pixel(aim_q - q, aim_r - r)
+    if ax == 0 and ay == 0:
+        return set()
+    pixels = [FOOTPRINTS.hex_to_pixel(dq, dr) for dq, dr in DIRECTIONS]
+    i = max(range(6), key=lambda d: pixels[d][0] * ax + pixels[d][1] * ay)
+    # Rows of even width lean to the side of the aim (counter-clockwise when dead on)
+    nx, ny = pixels[(i + 1) % 6]
+    dx, dy = pixels[i]
+    ccw = (dx * ay - dy * ax) * (dx * ny - dy * nx) >= 0
+    lean, other = ((i + 1) % 6, (i - 1) % 6) if ccw else ((i - 1) % 6, (i + 1) % 6)
+
+    # Row k is centered on the ring corner k steps out, and walks along the ring from it
+    dq, dr = DIRECTIONS[i]
+    lean_step = (DIRECTIONS[lean][0] - dq, DIRECTIONS[lean][1] - dr)
+    other_step = (DIRECTIONS[other][0] - dq, DIRECTIONS[other][1] - dr)
+    hexes = set()
+    for k in range(1, size + 1):
+        cq, cr = q + dq * k, r + dr * k
+        hexes.add((cq, cr))
+        for m in range(1, k // 2 + 1):
+            hexes.add((cq + lean_step[0] * m, cr + lean_step[1] * m))
+        for m in range(1, (k - 1) // 2 + 1):
+            hexes.add((cq + other_step[0] * m, cr + other_step[1] * m))
+    return hexes
+
+
+def line_hexes(q, r, aim_q, aim_r, size):
+    dq, dr = aim_q - q, aim_r - r
+    n = (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+    if n == 0:
+        return set()
+    # Stretch (or shrink) the aim to the line's length, then walk towards it
+    f = size / n
+    end_q, end_r = FOOTPRINTS.axial_round(q + dq * f, r + dr * f)
+    return set(FOOTPRINTS.hex_line(q, r, end_q, end_r)[1:size + 1])
+
+
+def template_hexes(kind, size, origin, aim=None, origin_size=1):
+    """
+    Hexes covered by a `kind` template of `size` from an attacker anchored at
+    `origin` (with a footprint of `origin_size`), aimed at hex `aim`. Blast,
+    Cone and Line need an aim, Burst doesn't.
+    """
+    q, r = origin
+    if kind == BURST:
+        return burst_hexes(q, r, size, origin_size)
+    if aim is None:
+        raise ValueError(f"{kind} needs a hex to aim at")
+    if kind == BLAST:
+        return blast_hexes(aim[0], aim[1], size)
+    if kind == CONE:
+        hexes = cone_hexes(q, r, aim[0], aim[1], size)
+    elif kind == LINE:
+        hexes = line_hexes(q, r, aim[0], aim[1], size)
+    else:
+        raise ValueError(f"Unknown template {kind}")
+    # Cones and lines from large attackers start inside their own footprint
+    return hexes.difference(FOOTPRINTS.footprint_hexes(q, r, origin_size))
+
+
+def tokens_in(map_state, hexes, exclude=None):
+    """
+    Indices of the tokens covering any of `hexes`, other than `exclude`,
+    bottom-most first.
+    """
+    found = set()
+    items = map_state.items
+    for h in hexes:
+        for index in map_state.items_at(*h):
+            if items[index].is_token:
+                found.add(index)
+    found.discard(exclude)
+    return sorted(found)
+
+
+def resolve(map_state, kind, size, attacker_index, aim=None):
+    """
+    (hexes, target indices) of a template fired by the item at `attacker_index`.
+    The attacker is never one of its own targets.
+    """
+    attacker = map_state.items[attacker_index]
+    hexes = template_hexes(kind, size, (attacker.q, attacker.r), aim, attacker.size_class)
+    return hexes, tokens_in(map_state, hexes, exclude=attacker_index)
+
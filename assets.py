@@ -1,5 +1,9 @@
+import hashlib
+import json
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 def get_asset_root():
     # Helper to find where we are running from
@@ -29,7 +33,259 @@ def get_asset_root():
 
 ASSET_ROOT = get_asset_root()
 
-def scan_assets(directory=None):
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tiff', '.tif')
+TEXT_EXTS = ('.txt', '.md', '.json') # Files that can be linked to an item
+
+# Lives next to the global settings file
+INDEX_FILE = os.path.expanduser("~/.lancer_map_builder_asset_index.json")
+
+def get_category(root):
+    # Determine Category
+    lower_root = root.lower()
+    if "token" in lower_root:
+        return "Tokens"
+    elif "tile" in lower_root:
+        return "Tiles"
+    elif "hex" in lower_root:
+        return "Tiles"
+    return "Other"
+
+class AssetIndex:
+    """
+    Persistent record of every scanned asset folder, so a rescan only has to
+    list the folders whose mtime changed since the last run.
+
+    dirs: { dir_path: { "mtime": float, "category": str, "subdirs": [name, ...],
+                        "files": [[name, mtime, size, is_8x], ...],
+                        "texts": [[name, mtime, size], ...] } }
+    hashes: { file_path: [mtime, size, sha1] }, filled in on demand
+
+    The same index backs the missing-asset resolver (see find_moved_files).
+    """
+
+    VERSION = 3
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.dirs = {}
+        self.hashes = {}
+        self.changed = set() # Files whose mtime or size changed, in folders that were listed again
+        self.lock = threading.Lock() # Guards changes to dirs / hashes / changed, never held across I/O
+        self.save_lock = threading.Lock() # Held while writing the index file
+        self.dirty = False # Something to save
+        self._names = {} # top folder -> (folder entries it was built from, name table)
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.dirs = data.get("dirs", {})
+                self.hashes = data.get("hashes", {})
+        except Exception as e:
+            print(f"Error loading asset index: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        # The scan and the resolver may both save, one at a time
+        with self.save_lock:
+            try:
+                # Entries are replaced, never edited, so shallow copies are a consistent view.
+                # Changes made after this point are still unsaved.
+                with self.lock:
+                    data = {"version": self.VERSION, "dirs": dict(self.dirs), "hashes": dict(self.hashes)}
+                    self.dirty = False
+                # Per process and thread, the batch exporter saves from several at once
+                tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                print(f"Error saving asset index: {e}")
+                with self.lock:
+                    self.dirty = True
+
+    def scan_dir(self, dir_path):
+        """
+        Returns the index entry of `dir_path`, listing it only if its mtime changed.
+        """
+        mtime = os.stat(dir_path).st_mtime
+        entry = self.dirs.get(dir_path)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+
+        subdirs = []
+        files = []
+        texts = []
+        with os.scandir(dir_path) as it:
+            for e in it:
+                # Like os.walk, don't follow links to folders (a link to a parent would never end)
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(e.name)
+                elif e.name.lower().endswith(IMAGE_EXTS):
+                    st = e.stat()
+                    files.append([e.name, st.st_mtime, st.st_size, "8x" in os.path.join(dir_path, e.name).lower()])
+                elif e.name.lower().endswith(TEXT_EXTS):
+                    st = e.stat()
+                    texts.append([e.name, st.st_mtime, st.st_size])
+        subdirs.sort()
+        changed = []
+        if entry is not None:
+            old = {f[0]: (f[1], f[2]) for f in entry["files"]}
+            for name, f_mtime, f_size, _ in files:
+                if name in old and old[name] != (f_mtime, f_size):
+                    changed.append(os.path.join(dir_path, name))
+        entry = {"mtime": mtime, "category": get_category(dir_path), "subdirs": subdirs, "files": files, "texts": texts}
+        with self.lock:
+            self.changed.update(changed)
+            self.dirs[dir_path] = entry
+            self.dirty = True
+        return entry
+
+    def walk(self, top):
+        """
+        Yields (dir_path, entry) for `top` and every folder below it.
+        """
+        stack = [top]
+        while stack:
+            dir_path = stack.pop()
+            try:
+                entry = self.scan_dir(dir_path)
+            except OSError:
+                continue
+            yield dir_path, entry
+            stack.extend(os.path.join(dir_path, d) for d in reversed(entry["subdirs"]))
+
+    def take_changed(self):
+        with self.lock:
+            changed, self.changed = self.changed, set()
+        return changed
+
+    def prune(self, top, seen):
+        # Forget folders under `top` that no longer exist
+        prefix = os.path.join(top, "")
+        with self.lock:
+            for dir_path in [d for d in self.dirs if d.startswith(prefix) and d not in seen]:
+                del self.dirs[dir_path]
+                self.dirty = True
+            for file_path in [p for p in self.hashes if p.startswith(prefix) and os.path.dirname(p) not in self.dirs]:
+                del self.hashes[file_path]
+
+    def names(self, top):
+        """
+        Name table of every image and text file under `top`:
+        { name_key: [(path, mtime, size), ...] } for each key of name_keys().
+        Rebuilt only when a folder under `top` changed.
+        """
+        entries = []
+        for dir_path, entry in self.walk(top):
+            entries.append((dir_path, entry))
+        cached = self._names.get(top)
+        if cached is not None and len(cached[0]) == len(entries) and all(
+            a[1] is b[1] for a, b in zip(cached[0], entries)
+        ):
+            return cached[1]
+
+        table = {}
+        for dir_path, entry in entries:
+            for name, mtime, size, *_ in entry["files"] + entry.get("texts", []):
+                record = (os.path.join(dir_path, name), mtime, size)
+                for key in name_keys(name):
+                    table.setdefault(key, []).append(record)
+        self._names[top] = (entries, table)
+        return table
+
+    def file_hash(self, path, mtime, size):
+        # sha1 of the file contents, kept until the file changes
+        cached = self.hashes.get(path)
+        if cached is not None and cached[0] == mtime and cached[1] == size:
+            return cached[2]
+        h = hashlib.sha1()
+        try:
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+        except OSError:
+            return None
+        digest = h.hexdigest()
+        with self.lock:
+            self.hashes[path] = [mtime, size, digest]
+            self.dirty = True
+        return digest
+
+def scan_pack(index, pack_path):
+    """
+    Scans one pack folder. Returns ({ Category: [paths] }, visited folders).
+    """
+    categories = {}
+    seen = []
+
+    # Recursive walk to find images
+    for root, entry in index.walk(pack_path):
+        seen.append(root)
+        paths = categories.setdefault(entry["category"], [])
+        for name, _, _, _ in entry["files"]:
+            paths.append(os.path.join(root, name))
+
+    # Post-processing: Filter for 8x preference
+    pack_data = {}
+    for cat, paths in categories.items():
+        if not paths:
+            continue
+
+        # Check if this category has any "8x" files
+        has_8x = any("8x" in p.lower() for p in paths)
+
+        if has_8x:
+            # If we have 8x files, only keep those to avoid duplicates/low-res
+            filtered = [p for p in paths if "8x" in p.lower()]
+            pack_data[cat] = sorted(filtered)
+        else:
+            pack_data[cat] = sorted(paths)
+
+    return pack_data, seen
+
+def iter_scan_assets(directory=None, index=None):
+    """
+    Scans the MAPS directory for assets, yielding (pack_name, { Category: [paths] })
+    for every pack with content as soon as it is scanned. Packs are walked in
+    parallel, and folders that did not change since the last scan are taken
+    from the persistent AssetIndex. Safe to run off the UI thread.
+    """
+    target_dir = directory if directory else ASSET_ROOT
+
+    if not os.path.exists(target_dir):
+        print(f"Warning: Asset root not found at {target_dir}")
+        return
+
+    print(f"Scanning assets in: {target_dir}")
+
+    if index is None:
+        index = AssetIndex()
+
+    # Top level directories are usually "Packs"
+    packs = []
+    for pack_name in os.listdir(target_dir):
+        pack_path = os.path.join(target_dir, pack_name)
+        if os.path.isdir(pack_path):
+            packs.append((pack_name, pack_path))
+
+    seen = set()
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(packs)))) as pool:
+        results = pool.map(lambda pack: scan_pack(index, pack[1]), packs)
+        for (pack_name, _), (pack_data, pack_seen) in zip(packs, results):
+            seen.update(pack_seen)
+            if pack_data:
+                yield pack_name, pack_data
+
+    index.prune(target_dir, seen)
+    index.save()
+
+def scan_assets(directory=None, index=None):
     """
     Scans the MAPS directory for assets.
     Returns a dictionary of structure:
@@ -42,74 +298,99 @@ def scan_assets(directory=None):
         ...
     }
     """
-    assets = {}
+    return dict(iter_scan_assets(directory, index))
 
-    target_dir = directory if directory else ASSET_ROOT
+def name_keys(name):
+    """
+    Keys a file name is looked up by, most exact first: the name itself, the
+    name ignoring case, and the name ignoring case and extension plus the
+    kind of file (an asset re-exported as .webp still matches its .png).
+    """
+    lower = name.lower()
+    stem, ext = os.path.splitext(lower)
+    kind = "text" if ext in TEXT_EXTS else "image"
+    return ("=" + name, "~" + lower, f"{kind}:{stem}")
 
-    if not os.path.exists(target_dir):
-        print(f"Warning: Asset root not found at {target_dir}")
-        return assets
+def shared_suffix(a, b):
+    # Number of trailing path components two paths have in common, ignoring case
+    a_parts = a.replace("\\", "/").lower().split("/")
+    b_parts = b.replace("\\", "/").lower().split("/")
+    n = 0
+    while n < min(len(a_parts), len(b_parts)) and a_parts[-1 - n] == b_parts[-1 - n]:
+        n += 1
+    return n
 
-    print(f"Scanning assets in: {target_dir}")
+def find_moved_files(missing, folders, index):
+    """
+    Looks up where each path in `missing` went, in one pass over the index of
+    `folders`. Returns { missing_path: new_path } for the paths that were found.
 
-    # Top level directories are usually "Packs"
-    for pack_name in os.listdir(target_dir):
-        pack_path = os.path.join(target_dir, pack_name)
-        if not os.path.isdir(pack_path):
+    Candidates with the same name are told apart by how much of the old
+    relative pack path they still share (PackA/Tokens/goblin.png beats
+    PackB/goblin.png); copies with identical contents count as one.
+    """
+    tables = [index.names(top) for top in folders if top and os.path.isdir(top)]
+    found = {}
+    for old in missing:
+        name = os.path.basename(old.replace("\\", "/"))
+        candidates = []
+        for key in name_keys(name):
+            for table in tables:
+                candidates.extend(table.get(key, []))
+            if candidates:
+                break
+        if not candidates:
             continue
-        
-        assets[pack_name] = {}
-        
-        # Recursive walk to find images
-        for root, dirs, files in os.walk(pack_path):
-            lower_root = root.lower()
-            
-            # Determine Category
-            category = "Other"
-            if "token" in lower_root:
-                category = "Tokens"
-            elif "tile" in lower_root:
-                category = "Tiles"
-            elif "hex" in lower_root:
-                category = "Tiles"
-            
-            # Initialize category if missing
-            if category not in assets[pack_name]:
-                assets[pack_name][category] = []
-
-            for file in files:
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tiff', '.tif')):
-                    full_path = os.path.join(root, file)
-                    assets[pack_name][category].append(full_path)
 
-    # Post-processing: Filter for 8x preference
-    final_assets = {}
-    
-    for pack, categories in assets.items():
-        pack_data = {}
-        has_content = False
-        
-        for cat, paths in categories.items():
-            if not paths:
-                continue
-                
-            # Check if this category has any "8x" files
-            has_8x = any("8x" in p.lower() for p in paths)
-            
-            if has_8x:
-                # If we have 8x files, only keep those to avoid duplicates/low-res
-                filtered = [p for p in paths if "8x" in p.lower()]
-                pack_data[cat] = sorted(filtered)
-            else:
-                pack_data[cat] = sorted(paths)
-            
-            if pack_data[cat]:
-                has_content = True
-        
-        if has_content:
-            final_assets[pack] = pack_data
+        best = max(shared_suffix(old, c[0]) for c in candidates)
+        candidates = sorted(c for c in candidates if shared_suffix(old, c[0]) == best)
+        if len(candidates) > 1:
+            distinct = {index.file_hash(*c) for c in candidates}
+            if len(distinct) > 1:
+                print(f"Warning: {len(candidates)} different files could be {old}, using {candidates[0][0]}")
+        found[old] = candidates[0][0]
+    return found
+
+def resolve_missing_asset_paths(map_state, index=None):
+    """
+    Points items, markers, linked files and the background whose files have
+    moved to where they are now in the map's tokens or markers directory.
+    Nothing is scanned when every file is still in place.
+    """
+    missing = set()
+
+    def check(path):
+        if path and type(path) == str and not os.path.exists(path):
+            missing.add(path)
+
+    for item in map_state.items:
+        check(item.get("path"))
+        for m_path in item.get("markers", []):
+            check(m_path)
+        check(item.get("linked_file"))
+    check(map_state.background_image)
+    if not missing:
+        return
+
+    if index is None:
+        index = AssetIndex()
+    # Doesn't wait for a scan that is running, the index is safe to share with it
+    found = find_moved_files(missing, (map_state.tokens_directory, map_state.markers_directory), index)
+    if index.dirty:
+        index.save()
+    if not found:
+        return
 
-    return final_assets
+    for item in map_state.items:
+        if item.get("path") in found:
+            item["path"] = found[item["path"]]
+        markers = item.get("markers", [])
+        if any(m_path in found for m_path in markers):
+            item["markers"] = [found.get(m_path, m_path) for m_path in markers]
+        if item.get("linked_file") in found:
+            item["linked_file"] = found[item["linked_file"]]
+    if map_state.background_image in found:
+        map_state.background_image = found[map_state.background_image]
 
 if __name__ == "__main__":
     # Test run
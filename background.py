@@ -0,0 +1,235 @@
+import json
+import math
+import os
+import threading
+
+from PIL import Image
+
+from image_cache import LRUCache, MipmapPyramid
+
+TILE_SIZE = 512
+# Backgrounds above this many pixels are streamed from tiles instead of kept in memory
+TILED_MIN_PIXELS = 4096 * 4096
+
+
+class BackgroundImage:
+    """
+    A background map image prepared for viewport rendering.
+
+    Only the part of the map that is on screen (plus a margin, so small pans
+    can reuse the result) is ever resampled, and it is sampled from the
+    smallest mipmap level that still has enough detail for the zoom.
+    """
+
+    # Bumped whenever more detail becomes available, see TiledBackground
+    generation = 0
+    ready = True
+    error = None # Why a TiledBackground couldn't be built, see open_background
+
+    def __init__(self, image):
+        self.size = image.size
+        self.pyramid = MipmapPyramid(image)
+
+    def crop_rect(self, view, margin=0.5):
+        """
+        Expands the visible world rect `view` (x0, y0, x1, y1) by `margin`
+        times its size on each side and clips it to the image.
+        Returns None if the image is not in view at all.
+        """
+        x0, y0, x1, y1 = view
+        mx = (x1 - x0) * margin
+        my = (y1 - y0) * margin
+        w, h = self.size
+        x0, y0 = max(0, int(x0 - mx)), max(0, int(y0 - my))
+        x1, y1 = min(w, int(x1 + mx) + 1), min(h, int(y1 + my) + 1)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+
+    def render(self, rect, scale, resample=Image.Resampling.NEAREST):
+        """
+        Returns the world rect `rect` of the image resampled to `scale`.
+        """
+        x0, y0, x1, y1 = rect
+        display_w = max(1, round((x1 - x0) * scale))
+        display_h = max(1, round((y1 - y0) * scale))
+
+        index, level = self.pyramid.level_for(scale)
+        f = 0.5 ** index
+        box = (x0 * f, y0 * f, min(level.width, x1 * f), min(level.height, y1 * f))
+        return level.resize((display_w, display_h), resample, box=box)
+
+
+class TiledBackground(BackgroundImage):
+    """
+    A very large background streamed from fixed-size tiles.
+
+    The image is cut once into TILE_SIZE tiles at every mipmap level and the
+    tiles are written to a "<name>.tiles" folder next to the image. After
+    that only the tiles that intersect the view are decoded, and at most
+    `cache_bytes` of them are kept in memory, however big the map is.
+
+    Cutting the tiles takes a while, so unless `wait` is set it runs on a
+    worker thread. Levels are written coarsest first and each is used as
+    soon as it is complete; until then views are sampled from the finest
+    level that is, so the map shows up blurry at first and sharpens.
+    """
+
+    def __init__(self, path, tile_size=TILE_SIZE, cache_bytes=64 * 1024 * 1024, wait=False):
+        self.path = path
+        self.tile_size = tile_size
+        self.tile_dir = os.path.splitext(path)[0] + ".tiles"
+        self.tiles = LRUCache(cache_bytes)
+        self.preview = None # The smallest level, kept in memory while tiling
+
+        stat = os.stat(path)
+        self.source_stamp = [stat.st_mtime, stat.st_size]
+        manifest = self.read_manifest()
+        if manifest is not None:
+            self.mode = manifest["mode"]
+            self.levels = [tuple(s) for s in manifest["levels"]]
+            self.size = self.levels[0]
+            self.finest = 0
+            self.ready = True
+            return
+
+        # Nothing to show until the worker has the levels
+        with Image.open(path) as img:
+            self.size = img.size
+        self.mode = None
+        self.levels = []
+        self.finest = None # Index of the finest level that can be drawn, levels below it are all ready
+        self.ready = False
+        if wait:
+            self.build_tiles()
+        else:
+            threading.Thread(target=self.build_tiles, daemon=True).start()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.tile_dir, "manifest.json")
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("source") != self.source_stamp or manifest.get("tile_size") != self.tile_size:
+            return None
+        return manifest
+
+    def build_tiles(self):
+        # On the worker nothing else would see an exception, it ends up in `error`
+        try:
+            self._build_tiles()
+        except Exception as e:
+            self.error = f"Error tiling background {self.path}: {e}"
+            print(self.error)
+        self.ready = True
+
+    def _build_tiles(self):
+        ts = self.tile_size
+        with Image.open(self.path) as img:
+            level = img if img.mode in ("RGB", "RGBA") else img.convert("RGBA")
+            level.load()
+            levels = [level]
+            while max(level.size) > ts:
+                level = level.reduce(2)
+                levels.append(level)
+
+        self.mode = levels[-1].mode
+        self.levels = [level.size for level in levels]
+        self.preview = levels[-1]
+        self.finest = len(levels) - 1
+        self.generation += 1
+
+        os.makedirs(self.tile_dir, exist_ok=True)
+        for name in os.listdir(self.tile_dir):
+            if name.endswith(".png"):
+                os.remove(os.path.join(self.tile_dir, name))
+
+        for index in reversed(range(len(levels))):
+            level = levels[index]
+            w, h = level.size
+            for row in range(math.ceil(h / ts)):
+                for col in range(math.ceil(w / ts)):
+                    tile = level.crop((col * ts, row * ts, min(w, (col + 1) * ts), min(h, (row + 1) * ts)))
+                    tile.save(self.tile_path(index, col, row))
+            self.finest = index
+            self.generation += 1
+
+        manifest = {"source": self.source_stamp, "tile_size": ts, "mode": self.mode, "levels": [list(s) for s in self.levels]}
+        with open(self.manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    def tile_path(self, index, col, row):
+        return os.path.join(self.tile_dir, f"{index}_{col}_{row}.png")
+
+    def tile(self, index, col, row):
+        if index == len(self.levels) - 1 and self.preview is not None:
+            # Fits in a single tile
+            return self.preview
+        key = (index, col, row)
+        tile = self.tiles.get(key)
+        if tile is None:
+            with Image.open(self.tile_path(index, col, row)) as f:
+                tile = f.copy()
+            self.tiles.put(key, tile, tile.width * tile.height * len(tile.getbands()))
+        return tile
+
+    def render(self, rect, scale, resample=Image.Resampling.NEAREST):
+        x0, y0, x1, y1 = rect
+        display_w = max(1, round((x1 - x0) * scale))
+        display_h = max(1, round((y1 - y0) * scale))
+
+        # Same level choice as MipmapPyramid.level_for
+        finest = self.finest
+        if finest is None:
+            # Still decoding, nothing to show yet
+            return Image.new("RGBA", (display_w, display_h))
+        index = 0
+        while index + 1 < len(self.levels) and scale <= 0.5 ** (index + 1):
+            index += 1
+        index = max(index, finest)
+        f = 0.5 ** index
+        lw, lh = self.levels[index]
+
+        # Level pixels covered by the rect, assembled from the tiles under it
+        lx0, ly0 = int(x0 * f), int(y0 * f)
+        lx1, ly1 = min(lw, math.ceil(x1 * f)), min(lh, math.ceil(y1 * f))
+        mosaic = Image.new(self.mode, (max(1, lx1 - lx0), max(1, ly1 - ly0)))
+        ts = self.tile_size
+        for row in range(ly0 // ts, (ly1 - 1) // ts + 1):
+            for col in range(lx0 // ts, (lx1 - 1) // ts + 1):
+                mosaic.paste(self.tile(index, col, row), (col * ts - lx0, row * ts - ly0))
+
+        box = (x0 * f - lx0, y0 * f - ly0, min(lx1, x1 * f) - lx0, min(ly1, y1 * f) - ly0)
+        return mosaic.resize((display_w, display_h), resample, box=box)
+
+
+def open_background(path, wait=False, tiled=True):
+    """
+    Returns a TiledBackground for very large images and an in-memory
+    BackgroundImage otherwise, or None if the image can't be read.
+    Large images are tiled in the background unless `wait` is set; with
+    `tiled` off they are kept in memory like the others.
+    """
+    try:
+        # Only reads the header
+        with Image.open(path) as img:
+            w, h = img.size
+            if w * h < TILED_MIN_PIXELS or not tiled:
+                return BackgroundImage(img.copy())
+        bg = TiledBackground(path, wait=wait)
+        if bg.error is None:
+            return bg
+    except Exception as e:
+        print(f"Error loading background {path}: {e}")
+        return None
+    # e.g. read-only folder, keep it in memory instead
+    return open_background(path, tiled=False)
+
+
+def rect_contains(outer, inner):
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
@@ -0,0 +1,156 @@
+"""
+Command-line exporter: renders saved maps to images without opening the app.
+
+    python batch_export.py maps/ other_map.json -o previews --scale 0.5
+
+Maps are rendered in parallel, one process per core. A map is only rendered
+again when the map file, one of its assets or the export options changed
+since its last export.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from assets import AssetIndex, resolve_missing_asset_paths
+from image_cache import SourceImageCache
+from map_state import MapState
+from render import render_map
+
+# Input signatures of previous exports, keyed by output path
+MANIFEST_FILE = os.path.expanduser("~/.lancer_map_builder_export_index.json")
+
+# Per worker process
+_images = None
+_asset_index = None
+
+
+def init_worker(cache_mb):
+    # One image cache and asset index per worker, shared by every map it renders
+    global _images, _asset_index
+    _images = SourceImageCache(cache_mb * 1024 * 1024)
+    _asset_index = AssetIndex()
+
+
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return [path, None, None]
+    return [path, st.st_mtime_ns, st.st_size]
+
+
+def input_signature(map_path, map_state, options):
+    """
+    Everything the rendered image depends on: the export options, plus the
+    modification time and size of the map and of every file it draws.
+    """
+    paths = {map_state.background_image} if map_state.background_image else set()
+    for item in map_state.items:
+        paths.add(item.path)
+        paths.update(item.markers)
+    return {
+        "options": options,
+        "files": [file_stamp(map_path)] + [file_stamp(p) for p in sorted(paths)],
+    }
+
+
+def export_one(map_path, out_path, previous, options, force=False):
+    """
+    Renders one map. Returns (map_path, out_path, signature, status) where
+    status is "exported", "skipped" or an error message.
+    """
+    try:
+        map_state = MapState()
+        map_state.load_from_file(map_path)
+        resolve_missing_asset_paths(map_state, _asset_index)
+
+        signature = input_signature(map_path, map_state, options)
+        if not force and signature == previous and os.path.exists(out_path):
+            return map_path, out_path, signature, "skipped"
+
+        img = render_map(map_state, scale=options["scale"], images=_images, mode=options["mode"])
+        if os.path.splitext(out_path)[1].lower() not in (".png", ".webp"):
+            img = img.convert("RGB")
+        img.save(out_path)
+        return map_path, out_path, signature, "exported"
+    except Exception as e:
+        return map_path, out_path, None, f"failed: {e}"
+
+
+def find_maps(paths):
+    maps = []
+    for path in paths:
+        if os.path.isdir(path):
+            maps.extend(sorted(glob.glob(os.path.join(path, "*.json")) + glob.glob(os.path.join(path, "*.lmap"))))
+        else:
+            maps.append(path)
+    return [os.path.abspath(p) for p in maps]
+
+
+def output_path(map_path, out_dir, ext):
+    name = os.path.splitext(os.path.basename(map_path))[0] + ext
+    return os.path.join(out_dir or os.path.dirname(map_path), name)
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading export index: {e}")
+    return {}
+
+
+def save_manifest(path, manifest):
+    try:
+        with open(path, "w") as f:
+            json.dump(manifest, f)
+    except Exception as e:
+        print(f"Error saving export index: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export saved Lancer maps to images.")
+    parser.add_argument("maps", nargs="+", help="map files (.json or .lmap), or folders of them")
+    parser.add_argument("-o", "--out", help="output folder (default: next to each map)")
+    parser.add_argument("--format", default="png", choices=["png", "jpg", "webp", "bmp"])
+    parser.add_argument("--scale", type=float, default=1.0, help="output pixels per map pixel")
+    parser.add_argument("--mode", default="GUSTAV_NHP", choices=["GUSTAV_NHP", "WEBER_NHP"])
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache-mb", type=int, default=256, help="image cache size per worker")
+    parser.add_argument("--force", action="store_true", help="export even if nothing changed")
+    parser.add_argument("--manifest", default=MANIFEST_FILE)
+    args = parser.parse_args(argv)
+
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    options = {"scale": args.scale, "mode": args.mode}
+    manifest = load_manifest(args.manifest)
+
+    counts = {"exported": 0, "skipped": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.cache_mb,)) as pool:
+        futures = []
+        for map_path in find_maps(args.maps):
+            out_path = output_path(map_path, args.out, "." + args.format)
+            futures.append(pool.submit(export_one, map_path, out_path, manifest.get(out_path), options, args.force))
+
+        for future in as_completed(futures):
+            map_path, out_path, signature, status = future.result()
+            if signature is not None:
+                manifest[out_path] = signature
+                counts[status] += 1
+            else:
+                counts["failed"] += 1
+            print(f"{status}: {map_path}" + (f" -> {out_path}" if status == "exported" else ""))
+
+    save_manifest(args.manifest, manifest)
+    print(f"{counts['exported']} exported, {counts['skipped']} skipped, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,31 @@
 import math
 
+try:
+    import numpy as np
+except ImportError:
+    # Only the *_array batch methods need numpy
+    np = None
+
+SQRT3 = math.sqrt(3)
+
+# Axial neighbor offsets, counter-clockwise starting east (pointy top) / south-east (flat top)
+DIRECTIONS = ((1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1))
+
+def hex_distance(q1, r1, q2, r2):
+    dq = q1 - q2
+    dr = r1 - r2
+    return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+
 class HexGrid:
+    # Shared by every grid, axial offsets don't depend on the cell size or orientation
+    _footprint_cache = {}
+    _range_cache = {}
+    _line_cache = {}
+
     def __init__(self, size=50, flat_top=True):
         self.size = size  # Outer radius (center to corner)
         self.flat_top = flat_top
+        self._corner_cache = {}
 
     @property
     def width(self):
@@ -11,13 +33,13 @@ class HexGrid:
         if self.flat_top:
             return self.size * 2
         else:
-            return math.sqrt(3) * self.size
+            return SQRT3 * self.size
 
     @property
     def height(self):
         # Distance between opposite sides
         if self.flat_top:
-            return math.sqrt(3) * self.size
+            return SQRT3 * self.size
         else:
             return self.size * 2
 
@@ -27,9 +49,9 @@ class HexGrid:
         """
         if self.flat_top:
             x = self.size * (3/2 * q)
-            y = self.size * (math.sqrt(3)/2 * q + math.sqrt(3) * r)
+            y = self.size * (SQRT3/2 * q + SQRT3 * r)
         else:
-            x = self.size * (math.sqrt(3) * q + math.sqrt(3)/2 * r)
+            x = self.size * (SQRT3 * q + SQRT3/2 * r)
             y = self.size * (3/2 * r)
         return x, y
 
@@ -39,12 +61,38 @@ class HexGrid:
         """
         if self.flat_top:
             q = (2/3 * x) / self.size
-            r = (-1/3 * x + math.sqrt(3)/3 * y) / self.size
+            r = (-1/3 * x + SQRT3/3 * y) / self.size
         else:
-            q = (math.sqrt(3)/3 * x - 1/3 * y) / self.size
+            q = (SQRT3/3 * x - 1/3 * y) / self.size
             r = (2/3 * y) / self.size
         return self.axial_round(q, r)
 
+    def hexes_in_rect(self, x0, y0, x1, y1):
+        """
+        Yields the axial coordinates (q, r) of every hex that overlaps the pixel
+        rectangle (x0, y0)-(x1, y1), one row (column for flat top) at a time.
+        """
+        half_w = self.width / 2
+        half_h = self.height / 2
+        if self.flat_top:
+            # Columns of constant q, 3/2 * size apart
+            step = 1.5 * self.size
+            for q in range(math.ceil((x0 - half_w) / step), math.floor((x1 + half_w) / step) + 1):
+                # y = height * (r + q/2)
+                r_min = math.ceil((y0 - half_h) / self.height - q / 2)
+                r_max = math.floor((y1 + half_h) / self.height - q / 2)
+                for r in range(r_min, r_max + 1):
+                    yield q, r
+        else:
+            # Rows of constant r, 3/2 * size apart
+            step = 1.5 * self.size
+            for r in range(math.ceil((y0 - half_h) / step), math.floor((y1 + half_h) / step) + 1):
+                # x = width * (q + r/2)
+                q_min = math.ceil((x0 - half_w) / self.width - r / 2)
+                q_max = math.floor((x1 + half_w) / self.width - r / 2)
+                for q in range(q_min, q_max + 1):
+                    yield q, r
+
     def axial_round(self, q, r):
         """
         Rounds fractional hex coordinates to the nearest integer hex.
@@ -63,3 +111,170 @@ class HexGrid:
         # else s is unchanged (implied)
         
         return int(rq), int(rr)
+
+    def corner_offsets(self):
+        """
+        Offsets (dx, dy) of the six corners from a hex center, cached per
+        size and orientation.
+        """
+        key = (self.size, self.flat_top)
+        corners = self._corner_cache.get(key)
+        if corners is None:
+            corners = []
+            for i in range(6):
+                angle_rad = math.radians(60 * i - 30 if self.flat_top else 60 * i)
+                corners.append((self.size * math.cos(angle_rad), self.size * math.sin(angle_rad)))
+            corners = tuple(corners)
+            self._corner_cache[key] = corners
+        return corners
+
+    # --- Areas ---
+
+    def footprint(self, size):
+        """
+        Axial offsets of the hexes an item of Lancer `size` covers around its
+        anchor hex: 1 hex up to size 1 (size 1/2 included), 3 for size 2, 7 for
+        size 3, 12 for size 4. Odd sizes are centered on the anchor hex, even
+        sizes on the corner it shares with its (1, 0) and (0, 1) neighbors.
+        Items are still drawn centered on their anchor hex, as maps were
+        always laid out that way. Memoized per size.
+        """
+        size = max(1, int(size))
+        offsets = self._footprint_cache.get(size)
+        if offsets is None:
+            if size % 2:
+                cq, cr = 0.0, 0.0
+                limit = (size - 1) / 2
+            else:
+                cq, cr = 1 / 3, 1 / 3
+                limit = (size - 2) / 2 + 2 / 3
+            offsets = []
+            for dq in range(-size, size + 1):
+                for dr in range(-size, size + 1):
+                    fq = dq - cq
+                    fr = dr - cr
+                    if max(abs(fq), abs(fr), abs(fq + fr)) <= limit + 1e-9:
+                        offsets.append((dq, dr))
+            offsets = tuple(offsets)
+            self._footprint_cache[size] = offsets
+        return offsets
+
+    def footprint_hexes(self, q, r, size):
+        return [(q + dq, r + dr) for dq, dr in self.footprint(size)]
+
+    def hex_range(self, q, r, radius):
+        """
+        Every hex within `radius` steps of (q, r), (q, r) included.
+        """
+        offsets = self._range_cache.get(radius)
+        if offsets is None:
+            offsets = tuple(
+                (dq, dr)
+                for dq in range(-radius, radius + 1)
+                for dr in range(max(-radius, -dq - radius), min(radius, -dq + radius) + 1)
+            )
+            self._range_cache[radius] = offsets
+        return [(q + dq, r + dr) for dq, dr in offsets]
+
+    def hex_ring(self, q, r, radius):
+        """
+        The hexes exactly `radius` steps away from (q, r), walking around the ring.
+        """
+        if radius <= 0:
+            return [(q, r)]
+        # Start `radius` steps in direction 4 and walk each side
+        hq, hr = q + DIRECTIONS[4][0] * radius, r + DIRECTIONS[4][1] * radius
+        ring = []
+        for dq, dr in DIRECTIONS:
+            for _ in range(radius):
+                ring.append((hq, hr))
+                hq += dq
+                hr += dr
+        return ring
+
+    def hex_line(self, q1, r1, q2, r2, nudge=1e-6):
+        """
+        Hexes on the straight line from (q1, r1) to (q2, r2), both ends included.
+        The line is nudged off exact corners so ties always go the same way;
+        a negative `nudge` gives the line on the other side of a tie.
+        Lines are memoized by their offset, so only new shapes are rasterized.
+        """
+        return [(q1 + dq, r1 + dr) for dq, dr in self.line_offsets(q2 - q1, r2 - r1, nudge)]
+
+    def line_offsets(self, dq, dr, nudge=1e-6):
+        key = (dq, dr, nudge)
+        offsets = self._line_cache.get(key)
+        if offsets is None:
+            n = hex_distance(0, 0, dq, dr)
+            # Nudge in cube space, s = -q - r
+            offsets = tuple(
+                self.axial_round(nudge + dq * i / n, nudge + dr * i / n) for i in range(n + 1)
+            ) if n else ((0, 0),)
+            if len(self._line_cache) < 100000:
+                self._line_cache[key] = offsets
+        return offsets
+
+    # --- Batch variants (numpy) ---
+
+    def hex_to_pixel_array(self, q, r):
+        """
+        Converts arrays of axial coordinates to arrays of pixel coordinates.
+        """
+        q = np.asarray(q, dtype=float)
+        r = np.asarray(r, dtype=float)
+        if self.flat_top:
+            x = self.size * (3/2 * q)
+            y = self.size * (SQRT3/2 * q + SQRT3 * r)
+        else:
+            x = self.size * (SQRT3 * q + SQRT3/2 * r)
+            y = self.size * (3/2 * r)
+        return x, y
+
+    def pixel_to_hex_array(self, x, y):
+        """
+        Converts arrays of pixel coordinates to arrays of integer hex coordinates.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if self.flat_top:
+            q = (2/3 * x) / self.size
+            r = (-1/3 * x + SQRT3/3 * y) / self.size
+        else:
+            q = (SQRT3/3 * x - 1/3 * y) / self.size
+            r = (2/3 * y) / self.size
+        return self.axial_round_array(q, r)
+
+    def axial_round_array(self, q, r):
+        """
+        Cube rounding of whole arrays of fractional hex coordinates.
+        """
+        q = np.asarray(q, dtype=float)
+        r = np.asarray(r, dtype=float)
+        s = -q - r
+        # round() in axial_round rounds halves to even, and so does np.rint
+        rq, rr, rs = np.rint(q), np.rint(r), np.rint(s)
+
+        q_diff = np.abs(rq - q)
+        r_diff = np.abs(rr - r)
+        s_diff = np.abs(rs - s)
+
+        fix_q = (q_diff > r_diff) & (q_diff > s_diff)
+        fix_r = ~fix_q & (r_diff > s_diff)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        return rq.astype(int), rr.astype(int)
+
+    def corner_offsets_array(self):
+        """
+        The corner offsets as a (6, 2) array.
+        """
+        return np.array(self.corner_offsets())
+
+    def hex_polygons_array(self, q, r):
+        """
+        Corner coordinates of many hexes at once, as an (n, 6, 2) array built
+        with one broadcast add of the corner table to the centers.
+        """
+        x, y = self.hex_to_pixel_array(q, r)
+        centers = np.stack([x, y], axis=-1)
+        return centers[:, None, :] + self.corner_offsets_array()[None, :, :]
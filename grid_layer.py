@@ -0,0 +1,81 @@
+import math
+
+from PIL import Image, ImageColor, ImageDraw
+
+from grid import np
+
+
+def grid_period(grid):
+    """
+    World distance (x, y) after which the hex pattern repeats itself.
+    """
+    if grid.flat_top:
+        return 3 * grid.size, grid.height
+    return grid.width, 3 * grid.size
+
+
+def draw_grid(draw, grid, scale, color, rect, clip=None):
+    """
+    Draws the outline of every hex overlapping `rect` (x0, y0, x1, y1, in
+    world units relative to the grid origin) with `draw`, where pixel (0, 0)
+    is the top-left corner of `rect`. Hexes whose center is outside `clip`
+    are skipped.
+    """
+    x0, y0, x1, y1 = rect
+    if np is not None:
+        draw_grid_array(draw, grid, scale, color, rect, clip)
+        return
+
+    corners = [(dx * scale, dy * scale) for dx, dy in grid.corner_offsets()]
+    for q, r in grid.hexes_in_rect(x0, y0, x1, y1):
+        hx, hy = grid.hex_to_pixel(q, r)
+        if clip is not None and not (clip[0] <= hx <= clip[2] and clip[1] <= hy <= clip[3]):
+            continue
+        sx = (hx - x0) * scale
+        sy = (hy - y0) * scale
+        draw.polygon([(sx + dx, sy + dy) for dx, dy in corners], outline=color)
+
+
+def draw_grid_array(draw, grid, scale, color, rect, clip=None):
+    # Same as draw_grid, with every polygon computed in one go
+    x0, y0, x1, y1 = rect
+    cells = np.array(list(grid.hexes_in_rect(x0, y0, x1, y1)), dtype=int).reshape(-1, 2)
+    if clip is not None:
+        hx, hy = grid.hex_to_pixel_array(cells[:, 0], cells[:, 1])
+        inside = (clip[0] <= hx) & (hx <= clip[2]) & (clip[1] <= hy) & (hy <= clip[3])
+        cells = cells[inside]
+    polygons = (grid.hex_polygons_array(cells[:, 0], cells[:, 1]) - (x0, y0)) * scale
+    for poly in polygons.reshape(len(polygons), 12).tolist():
+        draw.polygon(poly, outline=color)
+
+
+def render_grid(grid, scale, color, rect, clip=None, alpha=128):
+    """
+    Renders the grid over `rect` into a transparent RGBA image. The outline is
+    half transparent, like the stippled canvas polygons it replaces.
+    """
+    x0, y0, x1, y1 = rect
+    w = max(1, math.ceil((x1 - x0) * scale))
+    h = max(1, math.ceil((y1 - y0) * scale))
+    img = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+    rgba = ImageColor.getrgb(color)[:3] + (alpha,)
+    draw_grid(ImageDraw.Draw(img), grid, scale, rgba, rect, clip)
+    return img
+
+
+def wrapped_grid_rect(grid, scale, view_w, view_h):
+    """
+    Grid-relative world rect of the wrapped grid image: a `view_w` x `view_h`
+    pixel view plus one period of slack on each side, starting on a lattice point.
+    """
+    px, py = grid_period(grid)
+    return (-px, -py, px + view_w / scale, py + view_h / scale)
+
+
+def wrapped_grid_origin(grid, view_x0, view_y0):
+    """
+    Grid-relative world position for the top-left corner of the wrapped
+    grid image, given the top-left corner of the view.
+    """
+    px, py = grid_period(grid)
+    return math.floor(view_x0 / px) * px - px, math.floor(view_y0 / py) * py - py
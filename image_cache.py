@@ -0,0 +1,251 @@
+import os
+from collections import OrderedDict
+
+from PIL import Image, ImageTk
+
+
+def image_nbytes(img):
+    # Decoded size of a PIL image
+    return img.width * img.height * len(img.getbands())
+
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by an approximate size in bytes.
+    Pinned keys count towards the budget but are never evicted.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        self.discard(key)
+        if nbytes > self.max_bytes:
+            # Would evict everything else and still not fit
+            return
+        self._entries[key] = (value, nbytes)
+        self.total_bytes += nbytes
+        self.evict()
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def discard_where(self, predicate):
+        for key in [k for k in self._entries if predicate(k)]:
+            self.discard(key)
+
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Oldest first, skipping pinned entries
+        for key in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self.pin_key(key) in self.pinned:
+                continue
+            self.discard(key)
+            self.evictions += 1
+
+    def pin_key(self, key):
+        # What `pinned` is matched against
+        return key
+
+    def set_pinned(self, keys):
+        self.pinned = set(keys)
+        self.evict()
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SourceImageCache(LRUCache):
+    """
+    Decoded asset images (tokens, tiles, markers) keyed by (path, level),
+    where level k is the image downscaled by 2**k. Images of the items on the
+    map are pinned (by path) so that browsing packs can't evict them.
+
+    A request for a display size is served from the nearest level that is
+    still at least that big. JPEGs are decoded straight at that level in
+    draft mode; other formats are decoded and reduced to the level, and only
+    the reduced copy is stored.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        super().__init__(max_bytes)
+        self.sizes = {}  # path -> original (w, h), read from the header only
+        self.stamps = {}  # path -> (mtime, size) of the file the cached copies were decoded from
+
+    def pin_key(self, key):
+        return key[0]
+
+    def file_stamp(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime, st.st_size
+
+    def changed_paths(self):
+        """
+        Paths whose file was overwritten or removed since they were decoded.
+        Only stats the files this cache has seen, not the whole library.
+        """
+        return [path for path, stamp in list(self.stamps.items()) if self.file_stamp(path) != stamp]
+
+    def size_of(self, path):
+        size = self.sizes.get(path)
+        if size is None:
+            if path not in self.stamps:
+                self.stamps[path] = self.file_stamp(path)
+            try:
+                with Image.open(path) as f:
+                    size = f.size
+            except Exception as e:
+                print(f"Error loading image {path}: {e}")
+                return None
+            self.sizes[path] = size
+        return size
+
+    def load(self, path):
+        # Full resolution
+        return self.load_level(path, 0)
+
+    def load_for_size(self, path, display_w, display_h):
+        size = self.size_of(path)
+        if size is None:
+            return None
+        level = 0
+        while size[0] >> (level + 1) >= display_w and size[1] >> (level + 1) >= display_h and min(size) >> (level + 1) > 0:
+            level += 1
+        return self.load_level(path, level)
+
+    def load_level(self, path, level):
+        img = self.get((path, level))
+        if img is not None:
+            return img
+
+        # Reduce from the closest bigger level that is already decoded
+        for upper in range(level - 1, -1, -1):
+            entry = self._entries.get((path, upper))
+            if entry is not None:
+                return self._store_level(path, entry[0], upper, level)
+
+        if path not in self.stamps:
+            self.stamps[path] = self.file_stamp(path)
+        try:
+            with Image.open(path) as f:
+                if level > 0 and f.format == "JPEG":
+                    # Decoder scales by 1/2, 1/4 or 1/8, never below the requested size
+                    w, h = f.size
+                    f.draft(f.mode, (max(1, w >> level), max(1, h >> level)))
+                    img = f.copy()
+                    self.put((path, level), img, image_nbytes(img))
+                    return img
+                img = f.copy()
+        except Exception as e:
+            print(f"Error loading image {path}: {e}")
+            return None
+        return self._store_level(path, img, 0, level)
+
+    def _store_level(self, path, img, from_level, to_level):
+        # Only the requested level is kept, the bigger decode is dropped
+        if to_level > from_level and img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        for _ in range(from_level, to_level):
+            img = img.reduce(2)
+        self.put((path, to_level), img, image_nbytes(img))
+        return img
+
+    def invalidate(self, path):
+        # The file changed on disk
+        self.discard_where(lambda key: key[0] == path)
+        self.sizes.pop(path, None)
+        self.stamps.pop(path, None)
+
+
+class ScaledImageCache(LRUCache):
+    """
+    Resized PhotoImages keyed by (path, display_w, display_h, resample), so a
+    pan reuses every bitmap and a zoom resizes each asset once per zoom level.
+    """
+
+    def __init__(self, load_image, max_bytes=128 * 1024 * 1024):
+        super().__init__(max_bytes)
+        self.load_image = load_image  # (path, display_w, display_h) -> PIL image at least that big, or None
+
+    def invalidate(self, path):
+        self.discard_where(lambda key: key[0] == path)
+
+    def get_photo(self, path, display_w, display_h, resample):
+        key = (path, display_w, display_h, resample)
+        photo = self.get(key)
+        if photo is None:
+            img = self.load_image(path, display_w, display_h)
+            if img is None:
+                return None
+            photo = ImageTk.PhotoImage(img.resize((display_w, display_h), resample))
+            # RGBA bitmap on the Tk side
+            self.put(key, photo, display_w * display_h * 4)
+        return photo
+
+
+class MipmapPyramid:
+    """
+    An image plus precomputed 1/2, 1/4, ... downscales, so zoomed-out views
+    can sample a small level instead of the full resolution source.
+    """
+
+    def __init__(self, image, min_size=256):
+        self.size = image.size
+        self.levels = [image]
+
+        level = image
+        if level.mode not in ("RGB", "RGBA", "L", "LA"):
+            level = level.convert("RGBA")
+        while max(level.size) > min_size:
+            level = level.reduce(2)
+            self.levels.append(level)
+
+    def level_for(self, scale):
+        """
+        Returns (index, image) of the smallest level whose resolution is still
+        at least `scale` times the original, i.e. never upsampled when shown.
+        """
+        index = 0
+        while index + 1 < len(self.levels) and scale <= 0.5 ** (index + 1):
+            index += 1
+        return index, self.levels[index]
@@ -0,0 +1,189 @@
+"""
+Autosave: an append-only journal of MapState changes plus a periodic snapshot.
+
+Every change to the map (item added, moved, deleted or edited, stroke
+finished, paint cleared, map settings changed) is appended to the journal as
+one JSON line by a background thread. Every `compact_every` changes the whole
+map is written to a snapshot (.lmap) next to it with an atomic rename, and the
+journal starts over. After a crash, loading the snapshot and replaying the
+journal gives back the session.
+
+A "running" marker sits next to them while the app is open and is removed on
+a clean exit, so a session is only recovered after the app didn't close
+properly.
+
+Journal lines carry a sequence number and the snapshot records the last one it
+includes, so lines that made it into the snapshot are never applied twice,
+even if the app died between writing the snapshot and truncating the journal.
+"""
+import io
+import json
+import os
+import queue
+import threading
+
+import map_format
+
+AUTOSAVE_DIR = os.path.expanduser("~/.lancer_map_builder_autosave")
+
+
+class Journal:
+    def __init__(self, map_state, directory=AUTOSAVE_DIR, compact_every=500):
+        self.map_state = map_state
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot" + map_format.EXTENSION)
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self.marker_path = os.path.join(directory, "running")
+        self.compact_every = compact_every
+        self.seq = 0
+        self.since_snapshot = 0
+        self.queue = queue.Queue()  # JSON lines, snapshots and the stop signal, in order
+        self._thread = None
+
+    def has_session(self):
+        # Only a session the app didn't shut down cleanly is worth recovering
+        if not os.path.exists(self.marker_path):
+            return False
+        return os.path.exists(self.snapshot_path) or (
+            os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0
+        )
+
+    def set_aside(self):
+        # Keeps a session that failed to load for inspection, out of the way of the next one
+        for path in (self.snapshot_path, self.journal_path):
+            if os.path.exists(path):
+                os.replace(path, path + ".broken")
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        open(self.marker_path, "w").close()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def record(self, op, **args):
+        """
+        Appends a change. Called by MapState right after it applied the change,
+        the line is serialized here so later edits to the same objects can't leak in.
+        """
+        self.seq += 1
+        args["op"] = op
+        args["seq"] = self.seq
+        self.queue.put(json.dumps(args, default=map_format.json_default) + "\n")
+        self.since_snapshot += 1
+        if self.since_snapshot >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        # Encoded on the calling thread so it matches the journal position exactly
+        buf = io.BytesIO()
+        map_format.write_map(buf, self.map_state.to_dict(), meta={"journal_seq": self.seq})
+        self.queue.put(buf.getvalue())
+        self.since_snapshot = 0
+
+    def close(self):
+        # Clean shutdown: everything is written and nothing needs recovering
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+        try:
+            os.remove(self.marker_path)
+        except OSError:
+            pass
+
+    def _write_loop(self):
+        f = open(self.journal_path, "a", encoding="utf-8")
+        try:
+            while True:
+                batch = [self.queue.get()]
+                # Everything queued meanwhile goes out in the same write
+                while True:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                lines = []
+                for entry in batch:
+                    if isinstance(entry, str):
+                        lines.append(entry)
+                        continue
+                    if lines:
+                        f.write("".join(lines))
+                        lines = []
+                    if entry is None:
+                        f.flush()
+                        return
+                    f.close()
+                    self._write_snapshot(entry)
+                    f = open(self.journal_path, "w", encoding="utf-8")
+                if lines:
+                    f.write("".join(lines))
+                f.flush()
+        except Exception as e:
+            print(f"Error writing autosave journal: {e}")
+        finally:
+            f.close()
+
+    def _write_snapshot(self, data):
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+
+    def replay(self):
+        """
+        Loads the snapshot and applies the journal after it to the map state.
+        Returns the number of journal lines applied. A torn last line (the app
+        died while writing it) ends the replay.
+        """
+        state = self.map_state
+        base_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                data = map_format.read_map(f)
+            base_seq = data.get("journal_seq", 0)
+            state.load_from_dict(data)
+
+        applied = 0
+        self.seq = base_seq
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    if entry["seq"] <= base_seq:
+                        continue
+                    try:
+                        apply_entry(state, entry)
+                    except Exception as e:
+                        print(f"Error replaying autosave journal: {e}")
+                        break
+                    self.seq = entry["seq"]
+                    applied += 1
+        return applied
+
+
+def apply_entry(state, entry):
+    # Redo one journal line on a MapState that isn't journaling
+    op = entry["op"]
+    if op == "add":
+        state.append_item(entry["item"])
+    elif op == "move":
+        state.move_item(entry["index"], entry["q"], entry["r"])
+    elif op == "delete":
+        state.delete_item(entry["index"])
+    elif op == "set":
+        state.update_item(entry["index"], **entry["fields"])
+    elif op == "stroke":
+        state.drawings.append(entry["line"])
+    elif op == "clear_paint":
+        state.clear_drawings()
+    elif op == "settings":
+        state.update_settings(**entry["values"])
+    else:
+        raise ValueError(f"Unknown journal entry {op}")
@@ -0,0 +1,145 @@
+"""
+Line of sight and cover between tokens.
+
+Sight lines are hex lines from every hex of one token's footprint to every
+hex of the other's, each drawn on both sides of a corner tie. Tiles on the
+hexes in between obstruct them: walls and buildings block sight, crates and
+barricades give hard cover, smoke and foliage soft cover. The least
+obstructed line decides: a target is seen clearly if any line is clear, and
+is out of sight only if every line is blocked.
+"""
+from map_state import FOOTPRINTS
+from pathfinding import BLOCKING_WORDS
+
+CLEAR = "none"
+SOFT = "soft"
+HARD = "hard"
+BLOCKED = "blocked"
+LEVELS = (CLEAR, SOFT, HARD, BLOCKED)
+
+# Tiles are sorted by their file name, walls that block movement block sight too.
+# "soft" is checked before the "cover" of hard cover, for "soft_cover.png"
+HARD_COVER_WORDS = ("cover", "crate", "barricade", "rubble", "debris", "rock", "container")
+SOFT_COVER_WORDS = ("smoke", "forest", "tree", "bush", "foliage", "fog")
+
+
+def tile_level(item):
+    # How much a tile obstructs sight, as an index into LEVELS
+    name = item.path.lower() if item.path else ""
+    if any(w in name for w in BLOCKING_WORDS):
+        return 3
+    if "soft" in name:
+        return 1
+    if any(w in name for w in HARD_COVER_WORDS):
+        return 2
+    if any(w in name for w in SOFT_COVER_WORDS):
+        return 1
+    return 0
+
+
+class VisibilityMatrix:
+    """
+    Pairwise line of sight between tokens, cached per pair. Every cached
+    pair remembers the hexes its sight lines went through; a change on any
+    of them (a token moving, a tile placed) drops just the pairs that looked
+    at it. Registers itself with the MapState for change notices.
+    """
+
+    def __init__(self, map_state):
+        self.map_state = map_state
+        self.pairs = {} # (id(a), id(b)) -> (a, b, level, hexes looked at)
+        self.by_hex = {} # (q, r) -> keys of the pairs that looked at it
+        self.levels = {} # (q, r) -> obstruction level of the tiles on it
+        map_state.watchers.append(self)
+
+    def hex_level(self, h):
+        level = self.levels.get(h)
+        if level is None:
+            level = 0
+            items = self.map_state.items
+            for index in self.map_state.items_at(*h):
+                item = items[index]
+                if not item.is_token:
+                    level = max(level, tile_level(item))
+            self.levels[h] = level
+        return level
+
+    def _compute(self, a, b):
+        hexes_a = FOOTPRINTS.footprint_hexes(a.q, a.r, a.size_class)
+        hexes_b = FOOTPRINTS.footprint_hexes(b.q, b.r, b.size_class)
+        ends = set(hexes_a) | set(hexes_b)
+        looked_at = set(ends)
+        best = 3
+        for qa, ra in hexes_a:
+            for qb, rb in hexes_b:
+                for nudge in (1e-6, -1e-6):
+                    level = 0
+                    for h in FOOTPRINTS.hex_line(qa, ra, qb, rb, nudge):
+                        if h in ends:
+                            continue
+                        looked_at.add(h)
+                        level = max(level, self.hex_level(h))
+                        if level >= best:
+                            break
+                    best = min(best, level)
+                    if best == 0:
+                        # Nothing can make it clearer, the other lines don't matter
+                        return best, looked_at
+        return best, looked_at
+
+    def level(self, index_a, index_b):
+        items = self.map_state.items
+        a, b = items[index_a], items[index_b]
+        if id(a) > id(b):
+            a, b = b, a
+        key = (id(a), id(b))
+        cached = self.pairs.get(key)
+        if cached is not None and cached[0] is a and cached[1] is b:
+            return cached[2]
+        level, looked_at = self._compute(a, b)
+        self.pairs[key] = (a, b, level, looked_at)
+        for h in looked_at:
+            self.by_hex.setdefault(h, set()).add(key)
+        return level
+
+    def cover(self, index_a, index_b):
+        """
+        What stands between two items: CLEAR, SOFT or HARD cover, or BLOCKED
+        if there is no line of sight at all.
+        """
+        return LEVELS[self.level(index_a, index_b)]
+
+    def can_see(self, index_a, index_b):
+        return self.level(index_a, index_b) < 3
+
+    def all_pairs(self):
+        """
+        { (i, j): cover } for every pair of tokens on the map, i < j.
+        """
+        tokens = [i for i, item in enumerate(self.map_state.items) if item.is_token]
+        result = {}
+        for n, i in enumerate(tokens):
+            for j in tokens[n + 1:]:
+                result[(i, j)] = LEVELS[self.level(i, j)]
+        return result
+
+    def map_changed(self, hexes):
+        """
+        Called by MapState with the hexes whose occupants changed, or None
+        when the whole map was replaced.
+        """
+        if hexes is None:
+            self.pairs = {}
+            self.by_hex = {}
+            self.levels = {}
+            return
+        for h in hexes:
+            self.levels.pop(h, None)
+            for key in self.by_hex.pop(h, ()):
+                entry = self.pairs.pop(key, None)
+                if entry is None:
+                    continue
+                for other in entry[3]:
+                    keys = self.by_hex.get(other)
+                    if keys is not None:
+                        keys.discard(key)
@@ -4,12 +4,34 @@ from PIL import Image, ImageTk, ImageDraw
 import os
 import math
 import json
+import queue
+import threading
 
-from assets import scan_assets, ASSET_ROOT
+from aoe import BLAST, BURST, SINGLE, TEMPLATES, resolve as resolve_template
+from assets import iter_scan_assets, resolve_missing_asset_paths, AssetIndex, ASSET_ROOT
 from grid import HexGrid
-from map_state import MapState
+from journal import Journal
+from line_of_sight import BLOCKED, CLEAR, VisibilityMatrix
+from map_state import MapState, is_token_path, size_class
+from pathfinding import MovementCache, token_speed
+from scene import ActiveStroke, CanvasScene, FrameScheduler
+from image_cache import LRUCache, ScaledImageCache, SourceImageCache
+from background import open_background, rect_contains
+from grid_layer import render_grid, wrapped_grid_origin, wrapped_grid_rect
+from render import render_map
+from strokes import simplify_stroke
+from thumbnails import ThumbnailCache
 
 class MapBuilderApp:
+    # Scene layers redrawn for each FrameScheduler layer
+    SCENE_LAYERS = {
+        "background": ("background",),
+        "grid": ("grid",),
+        "items": ("tile", "token"),
+        "paint": ("paint",),
+        "overlay": ("range",),
+    }
+
     def __init__(self, root):
         self.root = root
         self.root.title("Lancer Map Builder")
@@ -17,10 +39,18 @@ class MapBuilderApp:
 
         self.map_state = MapState()
         self.settings_file = os.path.expanduser("~/.lancer_map_builder_settings.json")
+        self.image_cache_mb = 128 # Budget for resized token/marker bitmaps
+        self.source_cache_mb = 256 # Budget for decoded asset images
         self.load_global_settings()
 
         self.grid = HexGrid(size=50, flat_top=False)
-        self.assets = scan_assets(self.map_state.tokens_directory)
+        self.asset_index = AssetIndex()
+        self.assets = {} # Filled in by the background scan, see start_asset_scan
+        self.scan_queue = queue.Queue()
+        self._scan_generation = 0
+        self._scan_polling = False
+        self._tree_nodes = {} # Tree node -> (pack, category or None) for lazy expansion
+        self.thumbnails = ThumbnailCache()
         
         # State for interactions
         self.selected_asset_path = None
@@ -29,16 +59,22 @@ class MapBuilderApp:
         self.camera_x = 0
         self.camera_y = 0
         self.scale = 1.0
-        self.loaded_images = {} # Cache for PIL images
-        self._tk_refs = [] # Keep references to PhotoImages
+        self.images = SourceImageCache(max_bytes=self.source_cache_mb * 1024 * 1024) # Cache for PIL images
+        self._background = None # (path, BackgroundImage) of the current map background
+        self.grid_images = LRUCache(32 * 1024 * 1024) # Pre-rendered grid overlays
+        self.scaled_images = ScaledImageCache(self.images.load_for_size, max_bytes=self.image_cache_mb * 1024 * 1024)
         
         self.hovered_item_index = None
         self.tooltip_x = 0
         self.tooltip_y = 0
 
         self.paint_mode = tk.BooleanVar(value=False)
+        self.show_movement = tk.BooleanVar(value=False) # Movement range of every token, not just the selected one
+        self.movement = MovementCache(self.map_state)
+        self.visibility = VisibilityMatrix(self.map_state)
         self.paint_color = tk.StringVar(value="white")
         self.current_drawing = None
+        self.active_stroke = None # Canvas lines of current_drawing while it is being drawn
         self.app_mode = tk.StringVar(value="GUSTAV_NHP")
         
         # Bind delete keys
@@ -50,6 +86,9 @@ class MapBuilderApp:
 
         self.apply_theme()
         self.setup_ui()
+        self.recover_session()
+        self.start_asset_scan(self.map_state.tokens_directory)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def load_global_settings(self):
         if os.path.exists(self.settings_file):
@@ -60,6 +99,8 @@ class MapBuilderApp:
                 if "ui_fg_color" in data: self.map_state.ui_fg_color = data["ui_fg_color"]
                 if "tokens_directory" in data: self.map_state.tokens_directory = data["tokens_directory"]
                 if "markers_directory" in data: self.map_state.markers_directory = data["markers_directory"]
+                if "image_cache_mb" in data: self.image_cache_mb = data["image_cache_mb"]
+                if "source_cache_mb" in data: self.source_cache_mb = data["source_cache_mb"]
             except Exception as e:
                 print(f"Error loading global settings: {e}")
 
@@ -69,7 +110,9 @@ class MapBuilderApp:
                 "ui_bg_color": self.map_state.ui_bg_color,
                 "ui_fg_color": self.map_state.ui_fg_color,
                 "tokens_directory": self.map_state.tokens_directory,
-                "markers_directory": self.map_state.markers_directory
+                "markers_directory": self.map_state.markers_directory,
+                "image_cache_mb": self.image_cache_mb,
+                "source_cache_mb": self.source_cache_mb
             }
             with open(self.settings_file, "w") as f:
                 json.dump(data, f, indent=2)
@@ -132,16 +175,15 @@ class MapBuilderApp:
         top.destroy()
         dir_path = filedialog.askdirectory(title="Select Tokens Directory", initialdir=self.map_state.tokens_directory)
         if dir_path:
-            self.map_state.tokens_directory = dir_path
-            self.assets = scan_assets(dir_path)
-            self.populate_tree()
+            self.map_state.update_settings(tokens_directory=dir_path)
+            self.start_asset_scan(dir_path)
             self.save_global_settings()
 
     def change_markers_directory(self, top):
         top.destroy()
         dir_path = filedialog.askdirectory(title="Select Markers Directory", initialdir=self.map_state.markers_directory)
         if dir_path:
-            self.map_state.markers_directory = dir_path
+            self.map_state.update_settings(markers_directory=dir_path)
             self.save_global_settings()
 
     def open_settings_overlay(self):
@@ -167,10 +209,10 @@ class MapBuilderApp:
             top.destroy()
         bg = colorchooser.askcolor(title="Background Color", initialcolor=self.map_state.ui_bg_color)
         if bg[1]:
-            self.map_state.ui_bg_color = bg[1]
+            self.map_state.update_settings(ui_bg_color=bg[1])
         fg = colorchooser.askcolor(title="Foreground/Accent Color", initialcolor=self.map_state.ui_fg_color)
         if fg[1]:
-            self.map_state.ui_fg_color = fg[1]
+            self.map_state.update_settings(ui_fg_color=fg[1])
             
         self.apply_theme()
         self.save_global_settings()
@@ -193,6 +235,7 @@ class MapBuilderApp:
         ttk.Checkbutton(self.toolbar, text="Paint Mode", variable=self.paint_mode, style="Toolbutton").pack(side="left", padx=2, pady=5)
         ttk.Combobox(self.toolbar, textvariable=self.paint_color, values=["white", "red", "blue", "green", "yellow", "black"], state="readonly", width=8).pack(side="left", padx=2, pady=5)
         ttk.Button(self.toolbar, text="Clear Paint", command=self.clear_paint).pack(side="left", padx=2, pady=5)
+        ttk.Checkbutton(self.toolbar, text="Movement", variable=self.show_movement, style="Toolbutton", command=lambda: self.draw_wrapper("overlay")).pack(side="left", padx=2, pady=5)
         
         ttk.Separator(self.toolbar, orient="vertical").pack(side="left", padx=5, fill="y")
         self.mode_cb = ttk.Combobox(self.toolbar, textvariable=self.app_mode, values=["GUSTAV_NHP", "WEBER_NHP"], state="readonly", width=12)
@@ -228,6 +271,7 @@ class MapBuilderApp:
         
         self.populate_tree()
         self.tree.bind("<<TreeviewSelect>>", self.on_asset_select)
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open)
 
         # Asset Preview
         ttk.Label(self.sidebar, text="Preview").pack(anchor="w", padx=5, pady=5)
@@ -321,6 +365,8 @@ class MapBuilderApp:
         
         self.canvas = tk.Canvas(self.canvas_frame, bg="#000000", highlightthickness=1, highlightbackground="#39ff14", highlightcolor="#39ff14")
         self.canvas.pack(fill="both", expand=True)
+        self.scene = CanvasScene(self.canvas)
+        self.frames = FrameScheduler(self.root, self.draw)
         
         # Bindings
         self.canvas.bind("<ButtonPress-1>", self.on_canvas_click)
@@ -338,26 +384,94 @@ class MapBuilderApp:
         self.root.after(10, self.draw_wrapper)
         self.app_mode.trace_add("write", self.on_mode_change)
 
+    def start_asset_scan(self, directory):
+        # Scan off the UI thread, packs arrive through scan_queue as they are done
+        self._scan_generation += 1
+        generation = self._scan_generation
+        # Previews of the old scan are queued again once this one is done
+        self.thumbnails.cancel_prefetch()
+        self.assets = {}
+        self.populate_tree()
+
+        def worker():
+            try:
+                for pack, categories in iter_scan_assets(directory, self.asset_index):
+                    self.scan_queue.put((generation, pack, categories))
+            except Exception as e:
+                print(f"Error scanning assets: {e}")
+            self.scan_queue.put((generation, None, None))
+
+        threading.Thread(target=worker, daemon=True).start()
+        if not self._scan_polling:
+            self._scan_polling = True
+            self.root.after(50, self.poll_asset_scan)
+
+    def poll_asset_scan(self):
+        done = False
+        while True:
+            try:
+                generation, pack, categories = self.scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self._scan_generation:
+                continue # Result of a scan that was superseded
+            if pack is None:
+                done = True
+                continue
+            self.assets[pack] = categories
+            self.insert_pack_node(pack, categories)
+        if done:
+            self._scan_polling = False
+            # Files edited in place don't touch their folder's mtime, so also check what is loaded
+            for path in self.asset_index.take_changed() | set(self.images.changed_paths()):
+                self.invalidate_image(path)
+            # Build the browser previews in the background
+            self.thumbnails.prefetch(p for categories in self.assets.values() for paths in categories.values() for p in paths)
+        else:
+            self.root.after(50, self.poll_asset_scan)
+
     def populate_tree(self):
         # Clear existing items
         for item in self.tree.get_children():
             self.tree.delete(item)
+        self._tree_nodes = {}
             
         # assets structure: { Pack: { Category: [paths] } }
         for pack, categories in self.assets.items():
-            pack_node = self.tree.insert("", "end", text=pack, open=False)
-            has_children = False
-            for cat, paths in categories.items():
-                if self.app_mode.get() == "WEBER_NHP" and cat != "Tokens":
-                    continue
-                cat_node = self.tree.insert(pack_node, "end", text=cat, open=False)
-                for path in paths:
-                    filename = os.path.basename(path)
-                    # Store full path in values
-                    self.tree.insert(cat_node, "end", text=filename, values=(path,))
-                    has_children = True
-            if not has_children:
-                self.tree.delete(pack_node)
+            self.insert_pack_node(pack, categories)
+
+    def visible_categories(self, categories):
+        if self.app_mode.get() == "WEBER_NHP":
+            return [cat for cat in categories if cat == "Tokens"]
+        return list(categories)
+
+    def insert_pack_node(self, pack, categories):
+        # Children are only inserted when the node is first expanded (on_tree_open)
+        if not self.visible_categories(categories):
+            return
+        pack_node = self.tree.insert("", "end", text=pack, open=False)
+        self.tree.insert(pack_node, "end", text="...", tags=("placeholder",))
+        self._tree_nodes[pack_node] = (pack, None)
+
+    def on_tree_open(self, event=None):
+        node = self.tree.focus()
+        children = self.tree.get_children(node)
+        if node not in self._tree_nodes or len(children) != 1 or "placeholder" not in self.tree.item(children[0], "tags"):
+            return
+        self.tree.delete(children[0])
+        
+        pack, cat = self._tree_nodes[node]
+        categories = self.assets.get(pack, {})
+        if cat is None:
+            for cat in self.visible_categories(categories):
+                cat_node = self.tree.insert(node, "end", text=cat, open=False)
+                self.tree.insert(cat_node, "end", text="...", tags=("placeholder",))
+                self._tree_nodes[cat_node] = (pack, cat)
+        else:
+            for path in categories.get(cat, []):
+                filename = os.path.basename(path)
+                # Store full path in values
+                self.tree.insert(node, "end", text=filename, values=(path,))
 
     def on_mode_change(self, *args):
         self.populate_tree()
@@ -374,12 +488,12 @@ class MapBuilderApp:
             filetypes=[("Image Files", "*.png *.jpg *.jpeg *.bmp *.gif *.webp *.tiff *.tif"), ("All Files", "*.*")]
         )
         if f:
-            self.map_state.background_image = f
+            self.map_state.update_settings(background_image=f)
             
             # Auto-fit the camera and scale to the loaded image
-            bg_img = self.get_image(f)
-            if bg_img:
-                orig_w, orig_h = bg_img.size
+            bg = self.get_background(f)
+            if bg:
+                orig_w, orig_h = bg.size
                 cw = self.canvas.winfo_width()
                 ch = self.canvas.winfo_height()
                 
@@ -408,17 +522,29 @@ class MapBuilderApp:
             # Choosing an asset implicitly enters "Place Mode" (clears selection)
             self.selected_item_index = None
             self.update_attachment_ui()
-            self.draw_wrapper()
+            self.draw_wrapper("items", "overlay")
 
     def update_preview(self, path):
-        img = self.get_image(path)
-        if img:
-            # Resize for preview (max 250x250)
-            w, h = img.size
-            ratio = min(250/w, 250/h)
-            new_w, new_h = int(w*ratio), int(h*ratio)
-            resized = img.resize((new_w, new_h), Image.Resampling.NEAREST)
-            tk_img = ImageTk.PhotoImage(resized)
+        # Previews (max 250x250) come from the thumbnail cache, never from the full image
+        thumb = self.thumbnails.get(path)
+        if thumb is None:
+            self.preview_label.config(image="", text="Loading...")
+            future = self.thumbnails.request(path)
+            self.root.after(30, lambda: self.check_preview(path, future))
+            return
+        self.show_preview(thumb)
+
+    def check_preview(self, path, future):
+        if self.selected_asset_path != path:
+            return # Selection moved on
+        if not future.done():
+            self.root.after(30, lambda: self.check_preview(path, future))
+            return
+        self.show_preview(future.result())
+
+    def show_preview(self, thumb):
+        if thumb:
+            tk_img = ImageTk.PhotoImage(thumb)
             
             # Keep ref
             self.preview_image_ref = tk_img 
@@ -431,7 +557,7 @@ class MapBuilderApp:
         self.tree.selection_remove(self.tree.selection())
         self.preview_label.config(image="", text="No Selection")
         self.update_attachment_ui()
-        self.draw_wrapper()
+        self.draw_wrapper("items")
 
     def delete_selected_item(self, event=None):
         # Prevent deletion when typing in an entry or text field
@@ -440,10 +566,10 @@ class MapBuilderApp:
             
         if self.selected_item_index is not None:
             if 0 <= self.selected_item_index < len(self.map_state.items):
-                del self.map_state.items[self.selected_item_index]
+                self.map_state.delete_item(self.selected_item_index)
                 self.selected_item_index = None
                 self.update_attachment_ui()
-                self.draw_wrapper()
+                self.draw_wrapper("items", "overlay")
 
     def show_marker_menu(self, event=None):
         # Prevent marker trigger when typing
@@ -481,15 +607,15 @@ class MapBuilderApp:
     def toggle_marker(self, marker_path):
         if self.selected_item_index is None: return
         item = self.map_state.items[self.selected_item_index]
-        if "markers" not in item:
-            item["markers"] = []
+        markers = list(item.get("markers", []))
             
-        if marker_path in item["markers"]:
-            item["markers"].remove(marker_path)
+        if marker_path in markers:
+            markers.remove(marker_path)
         else:
-            item["markers"].append(marker_path)
+            markers.append(marker_path)
+        self.map_state.update_item(self.selected_item_index, markers=markers)
             
-        self.draw_wrapper()
+        self.draw_wrapper("items")
 
     # --- Attachment Logic ---
     def update_attachment_ui(self):
@@ -568,7 +694,7 @@ class MapBuilderApp:
         f = filedialog.askopenfilename(title="Select File to Attach")
         if f:
             item = self.map_state.items[self.selected_item_index]
-            item["linked_file"] = f
+            fields = {"linked_file": f}
             
             # Parse stats if text/md
             ext = os.path.splitext(f)[1].lower()
@@ -583,19 +709,22 @@ class MapBuilderApp:
                     evade_match = re.search(r'(?i)(?:evasion|evade)\s*[:=]?\s*(\d+)', text)
                     
                     if hp_match and 'max_hp' not in item:
-                        item['max_hp'] = int(hp_match.group(1))
-                        item['hp'] = item['max_hp']
+                        fields['max_hp'] = int(hp_match.group(1))
+                        fields['hp'] = fields['max_hp']
                     if struct_match and 'structure' not in item:
-                        item['structure'] = int(struct_match.group(1))
+                        fields['structure'] = int(struct_match.group(1))
                     if speed_match:
-                        item['speed'] = int(speed_match.group(1))
+                        fields['speed'] = int(speed_match.group(1))
                     if evade_match:
-                        item['evasion'] = int(evade_match.group(1))
+                        fields['evasion'] = int(evade_match.group(1))
                         
                 except Exception as e:
                     print(f"Error parsing stats: {e}")
             
+            self.map_state.update_item(self.selected_item_index, **fields)
             self.update_attachment_ui()
+            # The speed stat may have changed
+            self.draw_wrapper("overlay")
 
     def setup_right_sidebar(self):
         # Round Tracker
@@ -644,6 +773,14 @@ class MapBuilderApp:
         self.res_var = tk.BooleanVar(value=False)
         ttk.Checkbutton(atk_f3, text="Resist", variable=self.res_var).pack(side="left", padx=5)
 
+        atk_f4 = ttk.Frame(tools_frame)
+        atk_f4.pack(fill="x", pady=2)
+        ttk.Label(atk_f4, text="Area:").pack(side="left", padx=2)
+        self.aoe_var = tk.StringVar(value=SINGLE)
+        ttk.Combobox(atk_f4, textvariable=self.aoe_var, values=TEMPLATES, state="readonly", width=7).pack(side="left", padx=2)
+        self.aoe_size_var = tk.IntVar(value=1)
+        ttk.Entry(atk_f4, textvariable=self.aoe_size_var, width=3).pack(side="left")
+
         ttk.Button(tools_frame, text="Perform Attack", command=self.perform_attack).pack(fill="x", padx=2, pady=5)
         ttk.Button(tools_frame, text="Refresh Combatants", command=self.update_combat_comboboxes).pack(fill="x", padx=2, pady=2)
         
@@ -662,7 +799,7 @@ class MapBuilderApp:
         
     def update_custom_name(self, event=None):
         if self.selected_item_index is not None:
-            self.map_state.items[self.selected_item_index]["custom_name"] = self.name_var.get()
+            self.map_state.update_item(self.selected_item_index, custom_name=self.name_var.get())
             self.update_combat_comboboxes()
 
     def get_token_name(self, idx):
@@ -677,8 +814,7 @@ class MapBuilderApp:
     def update_combat_comboboxes(self):
         names = []
         for idx, item in enumerate(self.map_state.items):
-            p = item["path"].lower()
-            if "token" in p or "frame" in p:
+            if item.is_token:
                 names.append(f"[{idx}] {self.get_token_name(idx)}")
         
         self.cb_attacker['values'] = names
@@ -749,6 +885,10 @@ class MapBuilderApp:
 
     def perform_attack(self):
         import random
+        kind = self.aoe_var.get()
+        if kind != SINGLE:
+            self.perform_area_attack(kind)
+            return
         atk_idx = self.get_index_from_cb(self.cb_attacker.get())
         tgt_idx = self.get_index_from_cb(self.cb_target.get())
         
@@ -759,6 +899,13 @@ class MapBuilderApp:
         atk_name = self.get_token_name(atk_idx)
         tgt_name = self.get_token_name(tgt_idx)
         
+        cover = self.visibility.cover(atk_idx, tgt_idx)
+        if cover == BLOCKED:
+            self.log_to_terminal(f"> Attack Error: {atk_name} has no line of sight to {tgt_name}")
+            return
+        if cover != CLEAR:
+            self.log_to_terminal(f"> {tgt_name} is in {cover} cover")
+
         tgt_item = self.map_state.items[tgt_idx]
         evasion = tgt_item.get("evasion", 10) # default evasion
         
@@ -786,44 +933,124 @@ class MapBuilderApp:
             self.log_to_terminal(f"### {atk_name} attacks {tgt_name} ###")
             self.log_to_terminal(f"> Attack: {d20} + {bonus} = {atk_total} vs Evade {evasion} (MISS)")
 
-    def apply_damage(self, target_idx, dmg_str, is_crit=False, resist=False):
+    def perform_area_attack(self, kind):
+        # Blast, Burst, Cone or Line: one attack roll per target, one damage roll for all of them
+        import random
+        atk_idx = self.get_index_from_cb(self.cb_attacker.get())
+        if atk_idx is None:
+            self.log_to_terminal("> Attack Error: Select Attacker")
+            return
+        try:
+            size = int(self.aoe_size_var.get())
+        except:
+            size = 0
+        if size < 1:
+            self.log_to_terminal(f"> Attack Error: Invalid {kind} size")
+            return
+
+        atk_name = self.get_token_name(atk_idx)
+        aim = None
+        if kind != BURST:
+            tgt_idx = self.get_index_from_cb(self.cb_target.get())
+            if tgt_idx is None:
+                self.log_to_terminal(f"> Attack Error: Select a Target to aim the {kind} at")
+                return
+            if kind == BLAST and not self.visibility.can_see(atk_idx, tgt_idx):
+                self.log_to_terminal(f"> Attack Error: {atk_name} has no line of sight to {self.get_token_name(tgt_idx)}")
+                return
+            tgt_item = self.map_state.items[tgt_idx]
+            aim = (tgt_item.q, tgt_item.r)
+
+        hexes, targets = resolve_template(self.map_state, kind, size, atk_idx, aim)
+
+        try:
+            bonus = int(self.atk_bonus_var.get())
+        except:
+            bonus = 0
+
+        # Everything goes to the history as one entry
+        lines = [f"### {atk_name} attacks with {kind} {size} ({len(targets)} targets) ###"]
+        if not targets:
+            lines.append("> No targets in the area")
+            self.log_to_terminal("\n".join(lines))
+            return
+
+        hits = []
+        crits = []
+        for idx in targets:
+            name = self.get_token_name(idx)
+            evasion = self.map_state.items[idx].get("evasion", 10)
+            d20 = random.randint(1, 20)
+            atk_total = d20 + bonus
+            if d20 == 20:
+                crits.append(idx)
+                lines.append(f"> {name}: [CRIT 20] + {bonus} = {atk_total} vs Evade {evasion}")
+            elif atk_total >= evasion:
+                hits.append(idx)
+                lines.append(f"> {name}: {d20} + {bonus} = {atk_total} vs Evade {evasion} (HIT)")
+            else:
+                lines.append(f"> {name}: {d20} + {bonus} = {atk_total} vs Evade {evasion} (MISS)")
+
+        for group, is_crit in ((hits, False), (crits, True)):
+            if not group:
+                continue
+            total_dmg = self.roll_damage(self.atk_dmg_var.get(), is_crit, self.res_var.get(), lines.append)
+            if total_dmg is None:
+                break
+            for idx in group:
+                self.deal_damage(idx, total_dmg, lines.append)
+
+        self.log_to_terminal("\n".join(lines))
+        if self.selected_item_index in targets:
+            self.update_attachment_ui()
+
+    def roll_damage(self, dmg_str, is_crit=False, resist=False, log=None):
+        # Returns the damage to deal, or None if `dmg_str` isn't a valid roll
         import math
-        tgt_name = self.get_token_name(target_idx)
+        log = log or self.log_to_terminal
         res = self.roll_dice_string(dmg_str)
         if not res:
-            self.log_to_terminal(f"> Error: Invalid damage format {dmg_str}")
-            return
+            log(f"> Error: Invalid damage format {dmg_str}")
+            return None
             
         rolls, total_dmg = res
         
         if is_crit:
             res2 = self.roll_dice_string(dmg_str)
             rolls2, total2 = res2
-            self.log_to_terminal(f"> Crit Damage Roll 1: {rolls} = {total_dmg}")
-            self.log_to_terminal(f"> Crit Damage Roll 2: {rolls2} = {total2}")
+            log(f"> Crit Damage Roll 1: {rolls} = {total_dmg}")
+            log(f"> Crit Damage Roll 2: {rolls2} = {total2}")
             total_dmg += total2
-            self.log_to_terminal(f"> Initial Total Damage: {total_dmg}")
+            log(f"> Initial Total Damage: {total_dmg}")
         else:
-            self.log_to_terminal(f"> Initial Damage Roll: {rolls} = {total_dmg}")
+            log(f"> Initial Damage Roll: {rolls} = {total_dmg}")
             
         if resist:
             old_dmg = total_dmg
             total_dmg = math.ceil(total_dmg / 2)
-            self.log_to_terminal(f"> Resisted! ({old_dmg} / 2) -> {total_dmg} dmg")
-            
-        # Apply to target
+            log(f"> Resisted! ({old_dmg} / 2) -> {total_dmg} dmg")
+        return total_dmg
+
+    def deal_damage(self, target_idx, total_dmg, log=None):
+        log = log or self.log_to_terminal
+        tgt_name = self.get_token_name(target_idx)
         tgt_item = self.map_state.items[target_idx]
         if 'hp' in tgt_item:
-            tgt_item['hp'] -= total_dmg
-            self.log_to_terminal(f"> {tgt_name} takes {total_dmg} dmg. HP: {tgt_item['hp']}")
+            self.map_state.update_item(target_idx, hp=tgt_item['hp'] - total_dmg)
+            log(f"> {tgt_name} takes {total_dmg} dmg. HP: {tgt_item['hp']}")
             if tgt_item['hp'] <= 0:
-                self.log_to_terminal(f"> {tgt_name} IS DESTROYED / HP DEPLETED!")
+                log(f"> {tgt_name} IS DESTROYED / HP DEPLETED!")
                 if 'structure' in tgt_item:
-                    tgt_item['structure'] -= 1
-                    tgt_item['hp'] = tgt_item.get('max_hp', 0)
-                    self.log_to_terminal(f"> {tgt_name} loses 1 Structure. Struct: {tgt_item['structure']}. HP Reset.")
+                    self.map_state.update_item(target_idx, structure=tgt_item['structure'] - 1, hp=tgt_item.get('max_hp', 0))
+                    log(f"> {tgt_name} loses 1 Structure. Struct: {tgt_item['structure']}. HP Reset.")
         else:
-            self.log_to_terminal(f"> {tgt_name} has no HP stats to reduce.")
+            log(f"> {tgt_name} has no HP stats to reduce.")
+
+    def apply_damage(self, target_idx, dmg_str, is_crit=False, resist=False):
+        total_dmg = self.roll_damage(dmg_str, is_crit, resist)
+        if total_dmg is None:
+            return
+        self.deal_damage(target_idx, total_dmg)
             
         if self.selected_item_index == target_idx:
             self.update_attachment_ui()
@@ -842,43 +1069,75 @@ class MapBuilderApp:
 
 
     def get_image(self, path):
-        if path not in self.loaded_images:
-            try:
-                img = Image.open(path)
-                self.loaded_images[path] = img
-            except Exception as e:
-                print(f"Error loading image {path}: {e}")
+        return self.images.load(path)
+
+    def invalidate_image(self, path):
+        # Drop every cached copy of an asset that changed on disk
+        self.images.invalidate(path)
+        self.scaled_images.invalidate(path)
+
+    def get_background(self, path):
+        # Only one background is shown at a time. It is kept out of the asset image cache,
+        # huge maps are streamed from tiles instead of held in memory.
+        if self._background is None or self._background[0] != path:
+            bg = open_background(path)
+            if bg is None:
                 return None
-        return self.loaded_images[path]
+            self._background = (path, bg)
+            if not bg.ready:
+                self.root.after(100, self.poll_background, bg, bg.generation)
+        return self._background[1]
+
+    def poll_background(self, bg, generation):
+        # Large backgrounds are tiled on a worker, redraw as their levels come in
+        if self._background is None or self._background[1] is not bg:
+            return
+        if bg.error is not None:
+            self.log_to_terminal(f"> {bg.error}, loading it without tiles")
+            # Kept even if None, so the failed background isn't tiled again on every frame
+            self._background = (self._background[0], open_background(self._background[0], tiled=False))
+            self.draw_wrapper("background")
+            return
+        if bg.generation != generation:
+            self.draw_wrapper("background")
+        if not bg.ready:
+            self.root.after(100, self.poll_background, bg, bg.generation)
 
     def choose_grid_color(self):
         color_code = colorchooser.askcolor(title="Choose grid color", initialcolor=self.map_state.grid_color)
         if color_code[1]:
-            self.map_state.grid_color = color_code[1]
+            self.map_state.update_settings(grid_color=color_code[1])
             self.draw_wrapper()
 
     def update_grid_config(self, event=None):
         try:
-            self.map_state.grid_size = self.grid_size_var.get()
-            self.map_state.grid_offset_x = self.offset_x_var.get()
-            self.map_state.grid_offset_y = self.offset_y_var.get()
+            values = {
+                "grid_size": self.grid_size_var.get(),
+                "grid_offset_x": self.offset_x_var.get(),
+                "grid_offset_y": self.offset_y_var.get(),
+            }
+            # Also called on every focus change, only record real edits
+            if any(getattr(self.map_state, k) != v for k, v in values.items()):
+                self.map_state.update_settings(**values)
             
             self.grid.size = self.map_state.grid_size
             self.draw_wrapper()
         except ValueError:
             pass
 
-    def draw_wrapper(self):
-        self.draw()
+    def draw_wrapper(self, *layers):
+        # Schedules a frame; with no layers everything is redrawn
+        self.frames.request(layers)
 
     def update_faction(self, event=None):
         if self.selected_item_index is not None:
-            self.map_state.items[self.selected_item_index]["faction"] = self.faction_var.get()
-            self.draw_wrapper()
+            self.map_state.update_item(self.selected_item_index, faction=self.faction_var.get())
+            # Factions decide who can move through whom
+            self.draw_wrapper("items", "overlay")
 
     def clear_paint(self):
-        self.map_state.drawings = []
-        self.draw_wrapper()
+        self.map_state.clear_drawings()
+        self.draw_wrapper("paint")
 
     def parse_size_from_filename(self, path):
         filename = os.path.basename(path).lower()
@@ -897,124 +1156,167 @@ class MapBuilderApp:
         # If it's a tile, default 1.
         return 1
 
-    def draw(self):
-        self.canvas.delete("all")
-        self._tk_refs = [] # Clear references
-        
-        cx, cy = self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2
+    def draw(self, layers=None):
+        # `layers` is the set of FrameScheduler.LAYERS that changed since the last frame
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        cx, cy = cw / 2, ch / 2
         
         gx = self.map_state.grid_offset_x
         gy = self.map_state.grid_offset_y
         
+        # Anything that changes where or how big things are drawn forces a re-layout.
+        # A plain camera move only translates the existing canvas items.
+        layout_key = (
+            self.scale, self.grid.size, self.grid.flat_top, gx, gy, cw, ch,
+            self.map_state.grid_color, self.map_state.background_image, self.app_mode.get()
+        )
+        scene = self.scene
+        moved = (self.camera_x, self.camera_y) != (scene.camera_x, scene.camera_y)
+        relayout = scene.begin_frame(layout_key, self.camera_x, self.camera_y, self.scale, cx, cy)
+        if layers is None or relayout or moved:
+            # Everything has to be laid out or culled again
+            layers = set(FrameScheduler.LAYERS)
+        
+        if "overlay" in layers:
+            # Tooltips live in screen space and are rebuilt on the next motion event
+            self.canvas.delete("tooltip")
+        
+        to_screen = scene.to_screen
+        
         bg_w, bg_h = None, None
+        bg = None
+        if self.map_state.background_image:
+            bg = self.get_background(self.map_state.background_image)
+            if bg:
+                bg_w, bg_h = bg.size
+        
         # Draw Background Image (Behind Grid)
-        if hasattr(self.map_state, 'background_image') and self.map_state.background_image:
-            bg_img = self.get_image(self.map_state.background_image)
-            if bg_img:
-                orig_w, orig_h = bg_img.size
-                bg_w, bg_h = orig_w, orig_h
-                display_w = int(orig_w * self.scale)
-                display_h = int(orig_h * self.scale)
-                
-                sx = (0 - self.camera_x) * self.scale + cx
-                sy = (0 - self.camera_y) * self.scale + cy
-                
-                try:
-                    resized_bg = bg_img.resize((display_w, display_h), Image.Resampling.NEAREST)
-                    tk_bg_img = ImageTk.PhotoImage(resized_bg)
-                    self._tk_refs.append(tk_bg_img)
-                    self.canvas.create_image(sx, sy, image=tk_bg_img, anchor="nw", tags="background")
-                except Exception as e:
-                    print(f"Error resizing background: {e}")
+        if bg and "background" in layers:
+            # Visible world rect, clipped to the image
+            view = (self.camera_x - cx / self.scale, self.camera_y - cy / self.scale,
+                    self.camera_x + cx / self.scale, self.camera_y + cy / self.scale)
+            visible = (max(0, view[0]), max(0, view[1]), min(bg_w, view[2]), min(bg_h, view[3]))
+            
+            # Reuse the rendered crop while the view stays inside it
+            current = scene.sig_of("background")
+            if current is not None and current[0] == self.map_state.background_image and current[2] == bg.generation and rect_contains(current[1], visible):
+                scene.keep("background", current, (0, 0))
+            else:
+                crop = bg.crop_rect(view)
+                if crop:
+                    sx, sy = to_screen(crop[0], crop[1])
+                    try:
+                        tk_bg_img = ImageTk.PhotoImage(bg.render(crop, self.scale))
+                        tag = scene.new_tag()
+                        self.canvas.create_image(sx, sy, image=tk_bg_img, anchor="nw", tags=("scene", "background", tag))
+                        scene.put("background", tag, "background", (self.map_state.background_image, crop, bg.generation), (0, 0), refs=[tk_bg_img])
+                    except Exception as e:
+                        print(f"Error resizing background: {e}")
         
         # Grid Drawing
-        q_center, r_center = self.grid.pixel_to_hex(self.camera_x - gx, self.camera_y - gy)
-        range_rad = 20 # Draw radius
-        
-        for q in range(int(q_center - range_rad), int(q_center + range_rad)):
-            for r in range(int(r_center - range_rad), int(r_center + range_rad)):
-                # Convert hex to pixel (World Space RELATIVE TO GRID ORIGIN)
-                wx, wy = self.grid.hex_to_pixel(q, r)
-                
-                # Apply Grid Offset to get Absolute World Space
-                wx += gx
-                wy += gy
-                
-                # Restrict grid to background image in WEBER mode
-                if self.app_mode.get() == "WEBER_NHP" and bg_w is not None and bg_h is not None:
-                    # check if hex center is outside boundaries (with a little margin)
-                    if not (-self.grid.size <= wx <= bg_w + self.grid.size and -self.grid.size <= wy <= bg_h + self.grid.size):
-                        continue
-
-                # World to Screen
-                sx = (wx - self.camera_x) * self.scale + cx
-                sy = (wy - self.camera_y) * self.scale + cy
-                
-                # Check if visible (roughly)
-                if not (-100 < sx < self.canvas.winfo_width() + 100 and -100 < sy < self.canvas.winfo_height() + 100):
-                    continue
-
-                # Draw Polygon
-                size = self.grid.size * self.scale
-                pts = []
-                for i in range(6):
-                    angle_deg = 60 * i - 30 if self.grid.flat_top else 60 * i
-                    angle_rad = math.radians(angle_deg)
-                    pts.append(sx + size * math.cos(angle_rad))
-                    pts.append(sy + size * math.sin(angle_rad))
-                self.canvas.create_polygon(pts, outline=self.map_state.grid_color, fill="", tags="grid", outlinestipple="gray50")
+        # The grid is a single pre-rendered image. Visible world rect relative to the grid origin:
+        if "grid" in layers:
+            view = (self.camera_x - cx / self.scale - gx, self.camera_y - cy / self.scale - gy,
+                    self.camera_x + cx / self.scale - gx, self.camera_y + cy / self.scale - gy)
+        
+            if self.app_mode.get() == "WEBER_NHP" and bg_w is not None and bg_h is not None:
+                # Restrict grid to background image in WEBER mode (hex centers inside it, with a little margin).
+                # The pattern doesn't repeat any more, so render the part around the view and reuse it while the view stays inside.
+                margin = self.grid.size
+                clip = (-margin - gx, -margin - gy, bg_w + margin - gx, bg_h + margin - gy)
+                current = scene.sig_of("grid")
+                if current is not None and rect_contains(current, view):
+                    scene.keep("grid", current, (0, 0))
+                else:
+                    mx, my = (view[2] - view[0]) / 2, (view[3] - view[1]) / 2
+                    crop = (view[0] - mx, view[1] - my, view[2] + mx, view[3] + my)
+                    tk_grid_img = ImageTk.PhotoImage(render_grid(self.grid, self.scale, self.map_state.grid_color, crop, clip))
+                    sx, sy = to_screen(crop[0] + gx, crop[1] + gy)
+                    tag = scene.new_tag()
+                    self.canvas.create_image(sx, sy, image=tk_grid_img, anchor="nw", tags=("scene", "grid", tag))
+                    scene.put("grid", tag, "grid", crop, (0, 0), refs=[tk_grid_img])
+            else:
+                # The hex pattern is periodic: one image a period larger than the view
+                # is wrapped back by a period whenever the camera moves past one.
+                ox, oy = wrapped_grid_origin(self.grid, view[0], view[1])
+                pos = (ox + gx, oy + gy)
+                if not scene.keep("grid", "wrapped", pos):
+                    key = (self.grid.size, self.grid.flat_top, self.scale, self.map_state.grid_color, cw, ch)
+                    tk_grid_img = self.grid_images.get(key)
+                    if tk_grid_img is None:
+                        rect = wrapped_grid_rect(self.grid, self.scale, cw, ch)
+                        tk_grid_img = ImageTk.PhotoImage(render_grid(self.grid, self.scale, self.map_state.grid_color, rect))
+                        self.grid_images.put(key, tk_grid_img, tk_grid_img.width() * tk_grid_img.height() * 4)
+                    sx, sy = to_screen(*pos)
+                    tag = scene.new_tag()
+                    self.canvas.create_image(sx, sy, image=tk_grid_img, anchor="nw", tags=("scene", "grid", tag))
+                    scene.put("grid", tag, "grid", "wrapped", pos, refs=[tk_grid_img])
 
         # Draw Items with Z-Index (Tiles first, then Tokens)
-        # Helper to check if item is token
-        def is_token(path):
-            p = path.lower()
-            return "token" in p or "frame" in p
-
         # Split items
         tiles = []
         tokens = []
         
         # Store index to keep track of selection
-        for idx, item in enumerate(self.map_state.items):
-            if is_token(item["path"]):
-                tokens.append((idx, item))
-            else:
-                tiles.append((idx, item))
-        
-        # Draw function to avoid duplication
-        def draw_item_obj(idx, item):
-            path = item["path"]
-            q, r = item["q"], item["r"]
+        if "items" in layers:
+            # Whatever is on the map stays decoded
+            on_map = set()
+            for item in self.map_state.items:
+                on_map.add(item.path)
+                on_map.update(item.markers)
+            self.images.set_pinned(on_map)
+            
+            # Only the items near the view, culled in bulk from the position arrays
+            view = (self.camera_x - cx / self.scale, self.camera_y - cy / self.scale,
+                    self.camera_x + cx / self.scale, self.camera_y + cy / self.scale)
+            items = self.map_state.items
+            for idx in self.map_state.indices_in_rect(self.grid, view, 200 / self.scale):
+                item = items[idx]
+                if item.is_token:
+                    tokens.append((idx, item))
+                else:
+                    tiles.append((idx, item))
+        
+        # Draw function to avoid duplication.
+        # `below` is the tag of the next item up in the same layer, so that
+        # newly created items keep the list order on the canvas.
+        def draw_item_obj(idx, item, layer, below):
+            path = item.path
+            q, r = item.q, item.r
             
             wx, wy = self.grid.hex_to_pixel(q, r)
             wx += gx
             wy += gy
             
-            sx = (wx - self.camera_x) * self.scale + cx
-            sy = (wy - self.camera_y) * self.scale + cy
-            
-            # Simple visibility check
-            if not (-200 < sx < self.canvas.winfo_width() + 200 and -200 < sy < self.canvas.winfo_height() + 200):
-                return
+            sx, sy = to_screen(wx, wy)
 
-            pil_img = self.get_image(path)
-            if pil_img:
+            key = ("item", id(item))
+            markers = item.markers
+            sig = (path, item.scale, tuple(markers), idx == self.selected_item_index)
+            if scene.keep(key, sig, (wx, wy)):
+                return scene.tag_of(key)
+
+            # Only the header is read here, the pixels are decoded at the display size
+            img_size = self.images.size_of(path)
+            if img_size:
                 # Calculate display size
                 base_size = self.grid.width * self.scale
-                item_scale = item.get("scale", 1.0)
+                item_scale = item.scale
                 display_w = int(base_size * item_scale)
                 
-                orig_w, orig_h = pil_img.size
-                if orig_w == 0: return
+                orig_w, orig_h = img_size
+                if orig_w == 0: return below
                 ratio = orig_h / orig_w
                 display_h = int(display_w * ratio)
                 
+                tag = scene.new_tag()
+                tags = ("scene", layer, tag)
+                refs = []
                 try:
-                    resized = pil_img.resize((display_w, display_h), Image.Resampling.NEAREST)
-                    tk_img = ImageTk.PhotoImage(resized)
-                    self._tk_refs.append(tk_img)
+                    tk_img = self.scaled_images.get_photo(path, display_w, display_h, Image.Resampling.NEAREST)
+                    refs.append(tk_img)
                     
-                    self.canvas.create_image(sx, sy, image=tk_img, anchor="center")
+                    self.canvas.create_image(sx, sy, image=tk_img, anchor="center", tags=tags)
                     
                     faction = item.get("faction", "Neutral")
                     # Team border removed as per user request
@@ -1025,11 +1327,10 @@ class MapBuilderApp:
                         self.canvas.create_rectangle(
                             sx - display_w/2, sy - display_h/2, 
                             sx + display_w/2, sy + display_h/2, 
-                            outline="cyan", width=3
+                            outline="cyan", width=3, tags=tags
                         )
                         
                     # Render Markers
-                    markers = item.get("markers", [])
                     if markers:
                         marker_size = max(16, int(display_w * 0.35))
                         total_w = (len(markers) - 1) * marker_size * 1.1
@@ -1037,36 +1338,84 @@ class MapBuilderApp:
                         m_y = sy + display_h / 2
                         
                         for i, m_path in enumerate(markers):
-                            m_img = self.get_image(m_path)
-                            if m_img:
+                            if self.images.size_of(m_path):
                                 m_x = start_x + i * marker_size * 1.1
                                 try:
-                                    m_resized = m_img.resize((marker_size, marker_size), Image.Resampling.LANCZOS)
-                                    tk_m_img = ImageTk.PhotoImage(m_resized)
-                                    self._tk_refs.append(tk_m_img)
-                                    self.canvas.create_image(m_x, m_y, image=tk_m_img, anchor="center")
+                                    tk_m_img = self.scaled_images.get_photo(m_path, marker_size, marker_size, Image.Resampling.LANCZOS)
+                                    refs.append(tk_m_img)
+                                    self.canvas.create_image(m_x, m_y, image=tk_m_img, anchor="center", tags=tags)
                                 except Exception as e:
                                     print(f"Error drawing marker: {e}")
                                     
                 except Exception as e:
                     print(f"Error resizing: {e}")
-
-        # Render Tiles
-        for idx, item in tiles:
-            draw_item_obj(idx, item)
+                
+                scene.put(key, tag, layer, sig, (wx, wy), refs=refs, below=below)
+                return tag
+            return below
+
+        # Render Tiles (top-most first, so each new item can be slotted below the one above it)
+        below = None
+        for idx, item in reversed(tiles):
+            below = draw_item_obj(idx, item, "tile", below)
             
         # Render Paint Drawings
-        for line in self.map_state.drawings:
-            if len(line["points"]) > 1:
-                pts = []
-                for p in line["points"]:
-                    pts.append((p["x"] - self.camera_x) * self.scale + cx)
-                    pts.append((p["y"] - self.camera_y) * self.scale + cy)
-                self.canvas.create_line(pts, fill=line.get("color", "white"), width=3, smooth=True)
+        if "paint" in layers:
+            for line in self.map_state.drawings:
+                if line is self.current_drawing:
+                    # Drawn incrementally by the active stroke
+                    if relayout and self.active_stroke:
+                        self.active_stroke.redraw(line["points"], to_screen)
+                    continue
+                if len(line["points"]) > 1:
+                    key = ("paint", id(line))
+                    sig = (line.get("color", "white"), len(line["points"]))
+                    if scene.keep(key, sig, (0, 0)):
+                        continue
+                    pts = []
+                    for p in line["points"]:
+                        sx, sy = to_screen(p["x"], p["y"])
+                        pts.append(sx)
+                        pts.append(sy)
+                    tag = scene.new_tag()
+                    self.canvas.create_line(pts, fill=line.get("color", "white"), width=3, smooth=True, tags=("scene", "paint", tag))
+                    scene.put(key, tag, "paint", sig, (0, 0))
+            
+        # Movement ranges, from the cache so only ranges touched by the last change are searched again
+        if "overlay" in layers:
+            if self.show_movement.get():
+                movers = range(len(self.map_state.items))
+            else:
+                movers = [self.selected_item_index] if self.selected_item_index is not None else []
+            corners = [(dx * self.scale, dy * self.scale) for dx, dy in self.grid.corner_offsets()]
+            for idx in movers:
+                item = self.map_state.items[idx]
+                if not item.is_token or not token_speed(item):
+                    continue
+                move_range = self.movement.reachable(idx)
+                key = ("range", id(item))
+                if scene.keep(key, id(move_range), (0, 0)):
+                    continue
+                tag = scene.new_tag()
+                for q, r in move_range.costs:
+                    wx, wy = self.grid.hex_to_pixel(q, r)
+                    sx, sy = to_screen(wx + gx, wy + gy)
+                    pts = []
+                    for dx, dy in corners:
+                        pts.append(sx + dx)
+                        pts.append(sy + dy)
+                    self.canvas.create_polygon(pts, fill="", outline=self.map_state.ui_fg_color, width=2, tags=("scene", "range", tag))
+                scene.put(key, tag, "range", id(move_range), (0, 0), refs=[move_range])
             
         # Render Tokens
-        for idx, item in tokens:
-            draw_item_obj(idx, item)
+        below = None
+        for idx, item in reversed(tokens):
+            below = draw_item_obj(idx, item, "token", below)
+        
+        drawn = []
+        for layer in layers:
+            drawn.extend(self.SCENE_LAYERS.get(layer, ()))
+        scene.end_frame(drawn)
 
     # --- Interaction ---
 
@@ -1085,17 +1434,10 @@ class MapBuilderApp:
         gy = self.map_state.grid_offset_y
         q, r = self.grid.pixel_to_hex(world_x - gx, world_y - gy)
         
-        found = -1
-        for i in range(len(self.map_state.items) - 1, -1, -1):
-            item = self.map_state.items[i]
-            p = item["path"].lower()
-            is_token = "token" in p or "frame" in p
-            if item["q"] == q and item["r"] == r and is_token:
-                found = i
-                break
+        found = self.map_state.item_at(q, r, tokens_only=True)
 
         if self.hovered_item_index != found:
-            self.hovered_item_index = found if found != -1 else None
+            self.hovered_item_index = found
             self.update_hover_tooltip(event.x, event.y)
         elif self.hovered_item_index is not None:
             self.move_hover_tooltip(event.x, event.y)
@@ -1166,6 +1508,8 @@ class MapBuilderApp:
         if self.paint_mode.get():
             self.current_drawing = {"color": self.paint_color.get(), "points": [{"x": world_x, "y": world_y}]}
             self.map_state.drawings.append(self.current_drawing)
+            self.active_stroke = ActiveStroke(self.canvas, self.current_drawing["color"])
+            self.active_stroke.extend(world_x, world_y, self.scene.to_screen)
             return
         
         # Adjust for grid offset before converting to Hex
@@ -1189,26 +1533,22 @@ class MapBuilderApp:
             scale_map = {0.5: 0.8, 1: 1.0, 2: 2.0, 3: 3.0, 4: 4.0}
             scale = scale_map.get(size, float(size))
             
+            if is_token_path(self.selected_asset_path):
+                blocking = self.tokens_in_the_way(q, r, size_class(scale))
+                if blocking:
+                    names = ", ".join(self.get_token_name(i) for i in blocking)
+                    self.log_to_terminal(f"> Can't place {os.path.basename(self.selected_asset_path)} there: {names} is in the way")
+                    return
+            
             self.map_state.add_item(self.selected_asset_path, q, r, scale=scale)
-            self.draw_wrapper()
+            self.draw_wrapper("items", "overlay")
         else:
             # SELECT MODE
-            # Find item at q, r
-            # Iterate backwards to select top-most
-            found = -1
-            for i in range(len(self.map_state.items) - 1, -1, -1):
-                item = self.map_state.items[i]
-                # Simple hit test: Exact hex match
-                # For larger items, this might be tricky (they occupy multiple hexes).
-                # For now, select by anchor hex.
-                if item["q"] == q and item["r"] == r:
-                    found = i
-                    break
-            
-            self.selected_item_index = found if found != -1 else None
+            # Top-most item covering q, r (larger items cover the hexes around their anchor)
+            self.selected_item_index = self.map_state.item_at(q, r)
             self.drag_item_index = self.selected_item_index # Prepare for drag
             self.update_attachment_ui()
-            self.draw_wrapper()
+            self.draw_wrapper("items", "overlay")
 
     def on_canvas_right_click(self, event):
         self._pan_start_x = event.x
@@ -1242,8 +1582,9 @@ class MapBuilderApp:
         world_y = (event.y - cy) / self.scale + self.camera_y
         
         if self.paint_mode.get() and self.current_drawing is not None:
+            # Extend the stroke on the canvas in place, no frame needed
             self.current_drawing["points"].append({"x": world_x, "y": world_y})
-            self.draw_wrapper()
+            self.active_stroke.extend(world_x, world_y, self.scene.to_screen)
             return
             
         # If in select mode and dragging item
@@ -1254,21 +1595,35 @@ class MapBuilderApp:
             
             # Update item pos
             if 0 <= self.drag_item_index < len(self.map_state.items):
-                self.map_state.items[self.drag_item_index]["q"] = q
-                self.map_state.items[self.drag_item_index]["r"] = r
-                self.draw_wrapper()
+                item = self.map_state.items[self.drag_item_index]
+                # A token stops at the last hex where it doesn't land on another one
+                if item.is_token and self.tokens_in_the_way(q, r, item.size_class, self.drag_item_index):
+                    return
+                self.map_state.move_item(self.drag_item_index, q, r)
+                self.draw_wrapper("items", "overlay")
+
+    def tokens_in_the_way(self, q, r, size, ignore=None):
+        # Tokens a token of `size` at (q, r) would overlap, from the hex index
+        items = self.map_state.items
+        return [i for i in self.map_state.overlapping(q, r, size, ignore) if items[i].is_token]
 
     def on_canvas_release(self, event):
         if self.paint_mode.get():
+            if self.current_drawing is not None:
+                # Store the stroke with only the points that matter at this zoom (1 px tolerance)
+                self.current_drawing["points"] = simplify_stroke(self.current_drawing["points"], 1.0 / self.scale)
+                self.map_state.finish_stroke(self.current_drawing)
+                self.active_stroke.delete()
             self.current_drawing = None
-            self.draw_wrapper()
+            self.active_stroke = None
+            self.draw_wrapper("paint")
             return
             
         self.drag_item_index = None
 
     # --- File Ops ---
     def save_map(self):
-        f = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON Map", "*.json")])
+        f = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON Map", "*.json"), ("Binary Map", "*.lmap")])
         if f:
             self.map_state.save_to_file(f)
             messagebox.showinfo("Saved", "Map saved successfully!")
@@ -1280,73 +1635,72 @@ class MapBuilderApp:
             title="Export Map as Image"
         )
         if not f: return
-        
-        self.canvas.update()
-        x = self.canvas.winfo_rootx()
-        y = self.canvas.winfo_rooty()
-        w = self.canvas.winfo_width()
-        h = self.canvas.winfo_height()
-        
-        from PIL import ImageGrab
+
+        # Whole map at the background's native resolution, rendered off-screen
         try:
-            img = ImageGrab.grab(bbox=(x, y, x + w, y + h))
+            img = render_map(self.map_state, self.grid, scale=1.0, images=self.images, mode=self.app_mode.get())
+            if os.path.splitext(f)[1].lower() not in (".png", ".webp"):
+                img = img.convert("RGB")
             img.save(f)
             messagebox.showinfo("Export Map", f"Map exported successfully to:\n{f}")
         except Exception as e:
             messagebox.showerror("Export Error", f"Failed to export map: {e}")
 
     def resolve_missing_asset_paths(self):
-        known_images = {}
-        known_text = {}
-        
-        def scan_dir_for_files(dir_path):
-            if not dir_path or not os.path.exists(dir_path): return
-            for root, dirs, files in os.walk(dir_path):
-                for file in files:
-                    lower_f = file.lower()
-                    full_p = os.path.join(root, file)
-                    if lower_f.endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tiff', '.tif')):
-                        known_images[file] = full_p
-                    elif lower_f.endswith(('.txt', '.md', '.json')):
-                        known_text[file] = full_p
-                        
-        scan_dir_for_files(self.map_state.tokens_directory)
-        scan_dir_for_files(self.map_state.markers_directory)
-        
-        for item in self.map_state.items:
-            path = item.get("path")
-            if path and not os.path.exists(path):
-                fname = os.path.basename(path)
-                if fname in known_images:
-                    item["path"] = known_images[fname]
-                    
-            linked = item.get("linked_file")
-            if linked and not os.path.exists(linked):
-                lname = os.path.basename(linked)
-                if lname in known_text:
-                    item["linked_file"] = known_text[lname]
-                    
-        bg_img = self.map_state.background_image
-        if bg_img and type(bg_img) == str and not os.path.exists(bg_img):
-            bname = os.path.basename(bg_img)
-            if bname in known_images:
-                self.map_state.background_image = known_images[bname]
+        resolve_missing_asset_paths(self.map_state, self.asset_index)
 
     def load_by_file(self):
-        f = filedialog.askopenfilename(filetypes=[("JSON Map", "*.json")])
+        f = filedialog.askopenfilename(filetypes=[("Map Files", "*.json *.lmap"), ("JSON Map", "*.json"), ("Binary Map", "*.lmap")])
         if f:
             self.map_state.load_from_file(f)
             self.save_global_settings() # Auto-update UI settings from loaded map
-            self.assets = scan_assets(self.map_state.tokens_directory)
-            self.resolve_missing_asset_paths()
-            self.populate_tree()
-            self.apply_theme()
-            # Update grid controls
-            self.grid_size_var.set(self.map_state.grid_size)
-            self.offset_x_var.set(self.map_state.grid_offset_x)
-            self.offset_y_var.set(self.map_state.grid_offset_y)
-            self.grid.size = self.map_state.grid_size
-            self.draw_wrapper()
+            self.start_asset_scan(self.map_state.tokens_directory)
+            self.refresh_loaded_map()
+
+    def refresh_loaded_map(self):
+        # UI state that follows a map replaced as a whole
+        self.resolve_missing_asset_paths()
+        self.apply_theme()
+        # Update grid controls
+        self.grid_size_var.set(self.map_state.grid_size)
+        self.offset_x_var.set(self.map_state.grid_offset_x)
+        self.offset_y_var.set(self.map_state.grid_offset_y)
+        self.grid.size = self.map_state.grid_size
+        self.draw_wrapper()
+
+    def recover_session(self):
+        # Bring back the autosaved session, then keep journaling from there
+        journal = Journal(self.map_state)
+        if journal.has_session():
+            before = self.map_state.to_dict()
+            try:
+                applied = journal.replay()
+                self.refresh_loaded_map()
+                self.log_to_terminal(f"> Recovered autosaved session ({applied} changes since last snapshot)")
+            except Exception as e:
+                print(f"Error recovering autosave: {e}")
+                # Don't let the new snapshot overwrite the only copy
+                journal.set_aside()
+                self.map_state.load_from_dict(before)
+                self.refresh_loaded_map()
+                self.log_to_terminal("> Autosaved session could not be recovered, it was moved aside")
+        try:
+            journal.start()
+            # New base for the journal; a recovered one may end in a torn line
+            journal.compact()
+        except Exception as e:
+            # The app works without autosave
+            print(f"Error starting autosave: {e}")
+            self.log_to_terminal(f"> Autosave disabled: {e}")
+            journal.close()
+            return
+        self.map_state.journal = journal
+
+    def on_close(self):
+        self.thumbnails.close()
+        if self.map_state.journal is not None:
+            self.map_state.journal.close()
+        self.root.destroy()
 
     def clear_map(self):
         if messagebox.askyesno("Clear Map", "Are you sure?"):
@@ -0,0 +1,349 @@
+"""
+Binary map container (.lmap), an alternative to the JSON map files.
+
+Layout, all little-endian:
+
+    header   b"LMAP", version (u16), reserved (u16)
+    chunks   tag (4 bytes), payload length (u32), payload
+
+Chunks are read one at a time, so a map never has to be in memory twice:
+
+    META  the map settings (grid, colors, directories, background) as JSON
+    STRS  strings appended to the string table: count (u32), then length (u16) + utf-8 each
+    ITEM  one map item (see pack_item)
+    STRK  one paint stroke: color (string id), point count (u32), float32 x/y pairs,
+          then JSON of any other keys
+    END!  end of the map
+
+Asset paths, item types, marker paths and stroke colors repeat a lot and are
+stored once in the string table and referenced by index. Stroke points are
+stored as float32, which is plenty for canvas coordinates but means a
+JSON -> .lmap -> JSON round trip can change the last digits of a point.
+Loaded strokes keep their points packed (PackedPoints) instead of turning
+every point into a dict.
+"""
+import json
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+
+MAGIC = b"LMAP"
+VERSION = 1
+EXTENSION = ".lmap"
+
+HEADER = struct.Struct("<4sHH")
+CHUNK = struct.Struct("<4sI")
+ITEM = struct.Struct("<BIii")  # flags, path id, q, r
+U32 = struct.Struct("<I")
+U16 = struct.Struct("<H")
+F64 = struct.Struct("<d")
+
+NO_STRING = 0xFFFFFFFF
+
+# ITEM flags: which optional fields follow the fixed part
+HAS_TYPE = 1
+HAS_SCALE = 2
+HAS_MARKERS = 4
+HAS_LINKED = 8
+HAS_EXTRA = 16
+RAW = 128  # Item didn't fit the layout, the payload is its JSON
+
+SETTINGS = (
+    "background_image", "background_color", "grid_size", "grid_color",
+    "ui_bg_color", "ui_fg_color", "tokens_directory", "markers_directory",
+    "grid_offset_x", "grid_offset_y",
+)
+
+
+class PackedPoints(Sequence):
+    """
+    Read-only stroke points backed by a float32 array of x, y pairs. Indexing
+    and iterating give {"x": .., "y": ..} dicts like a plain points list.
+    """
+
+    __slots__ = ("coords",)
+
+    def __init__(self, coords):
+        self.coords = coords
+
+    def __len__(self):
+        return len(self.coords) // 2
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("point index out of range")
+        return {"x": self.coords[2 * index], "y": self.coords[2 * index + 1]}
+
+    def __iter__(self):
+        coords = self.coords
+        for i in range(0, len(coords), 2):
+            yield {"x": coords[i], "y": coords[i + 1]}
+
+    def __eq__(self, other):
+        if isinstance(other, PackedPoints):
+            return self.coords == other.coords
+        if isinstance(other, list):
+            return list(self) == other
+        return NotImplemented
+
+
+def json_default(obj):
+    # For json.dump: packed points are written as a plain points list
+    if isinstance(obj, PackedPoints):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def is_binary_map(filepath):
+    try:
+        with open(filepath, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class StringTable:
+    # Strings to ids while writing; new strings are flushed before the chunk using them
+    def __init__(self):
+        self.ids = {}
+        self.pending = []
+
+    def id_of(self, s):
+        if s not in self.ids:
+            self.ids[s] = len(self.ids)
+            self.pending.append(s)
+        return self.ids[s]
+
+    def take_pending(self):
+        if not self.pending:
+            return None
+        parts = [U32.pack(len(self.pending))]
+        for s in self.pending:
+            data = s.encode("utf-8")
+            parts.append(U16.pack(len(data)))
+            parts.append(data)
+        self.pending = []
+        return b"".join(parts)
+
+
+def _is_int(v):
+    return type(v) == int and -2**31 <= v < 2**31
+
+
+def pack_item(item, strings):
+    """
+    flags, path id, q, r, then as flagged: type id (u32), scale (f64),
+    marker count (u16) + ids (u32 each), linked file id (u32), and JSON of
+    every other key (u32 length + utf-8).
+    """
+    path, q, r = item.get("path"), item.get("q"), item.get("r")
+    markers = item.get("markers")
+    fits = (
+        type(path) == str and _is_int(q) and _is_int(r)
+        and type(item.get("type", "")) == str
+        and type(item.get("scale", 1.0)) in (int, float)
+        and type(item.get("linked_file", "")) == str
+        and (markers is None or (type(markers) == list and len(markers) < 2**16 and all(type(m) == str for m in markers)))
+    )
+    if not fits:
+        return ITEM.pack(RAW, 0, 0, 0) + json.dumps(item).encode("utf-8")
+
+    flags = 0
+    parts = []
+    if "type" in item:
+        flags |= HAS_TYPE
+        parts.append(U32.pack(strings.id_of(item["type"])))
+    if "scale" in item:
+        flags |= HAS_SCALE
+        parts.append(F64.pack(item["scale"]))
+    if markers is not None:
+        flags |= HAS_MARKERS
+        parts.append(U16.pack(len(markers)))
+        parts.append(struct.pack(f"<{len(markers)}I", *[strings.id_of(m) for m in markers]))
+    if "linked_file" in item:
+        flags |= HAS_LINKED
+        parts.append(U32.pack(strings.id_of(item["linked_file"])))
+    extra = {k: v for k, v in item.items() if k not in ("path", "q", "r", "type", "scale", "markers", "linked_file")}
+    if extra:
+        flags |= HAS_EXTRA
+        data = json.dumps(extra).encode("utf-8")
+        parts.append(U32.pack(len(data)))
+        parts.append(data)
+    return ITEM.pack(flags, strings.id_of(path), q, r) + b"".join(parts)
+
+
+def unpack_item(payload, strings):
+    flags, path_id, q, r = ITEM.unpack_from(payload, 0)
+    if flags & RAW:
+        return json.loads(payload[ITEM.size:].decode("utf-8"))
+
+    item = {"path": strings[path_id], "q": q, "r": r}
+    pos = ITEM.size
+    if flags & HAS_TYPE:
+        item["type"] = strings[U32.unpack_from(payload, pos)[0]]
+        pos += U32.size
+    if flags & HAS_SCALE:
+        item["scale"] = F64.unpack_from(payload, pos)[0]
+        pos += F64.size
+    if flags & HAS_MARKERS:
+        count = U16.unpack_from(payload, pos)[0]
+        pos += U16.size
+        item["markers"] = [strings[i] for i in struct.unpack_from(f"<{count}I", payload, pos)]
+        pos += 4 * count
+    if flags & HAS_LINKED:
+        item["linked_file"] = strings[U32.unpack_from(payload, pos)[0]]
+        pos += U32.size
+    if flags & HAS_EXTRA:
+        length = U32.unpack_from(payload, pos)[0]
+        pos += U32.size
+        item.update(json.loads(payload[pos:pos + length].decode("utf-8")))
+    return item
+
+
+def pack_stroke(line, strings):
+    points = line.get("points", [])
+    color = line.get("color")
+    if isinstance(points, PackedPoints):
+        coords = array("f", points.coords)
+    else:
+        coords = array("f")
+        for p in points:
+            coords.append(p["x"])
+            coords.append(p["y"])
+    if sys.byteorder != "little":
+        coords.byteswap()
+    extra = {k: v for k, v in line.items() if k not in ("points", "color")}
+    data = json.dumps(extra).encode("utf-8") if extra else b""
+    color_id = strings.id_of(color) if type(color) == str else NO_STRING
+    return U32.pack(color_id) + U32.pack(len(points)) + coords.tobytes() + data
+
+
+def unpack_stroke(payload, strings):
+    color_id = U32.unpack_from(payload, 0)[0]
+    count = U32.unpack_from(payload, 4)[0]
+    end = 8 + 8 * count
+    coords = array("f")
+    coords.frombytes(payload[8:end])
+    if sys.byteorder != "little":
+        coords.byteswap()
+    line = {}
+    if color_id != NO_STRING:
+        line["color"] = strings[color_id]
+    line["points"] = PackedPoints(coords)
+    if end < len(payload):
+        line.update(json.loads(payload[end:].decode("utf-8")))
+    return line
+
+
+def write_chunk(f, tag, payload):
+    f.write(CHUNK.pack(tag, len(payload)))
+    f.write(payload)
+
+
+def write_map(f, data, meta=None):
+    """
+    Writes a map in the shape of MapState.to_dict() to the binary file `f`.
+    `meta` adds keys of its own to the META chunk; read_map returns them with the map.
+    """
+    strings = StringTable()
+    f.write(HEADER.pack(MAGIC, VERSION, 0))
+    settings = {k: data.get(k) for k in SETTINGS}
+    settings.update(meta or {})
+    write_chunk(f, b"META", json.dumps(settings).encode("utf-8"))
+
+    def write_with_strings(tag, payload):
+        pending = strings.take_pending()
+        if pending:
+            write_chunk(f, b"STRS", pending)
+        write_chunk(f, tag, payload)
+
+    for item in data.get("items", []):
+        write_with_strings(b"ITEM", pack_item(item, strings))
+    for line in data.get("drawings", []):
+        write_with_strings(b"STRK", pack_stroke(line, strings))
+    write_chunk(f, b"END!", b"")
+
+
+def iter_chunks(f):
+    """
+    Yields (tag, payload) for each chunk of the binary file `f`, after checking the header.
+    """
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not a map file: too short")
+    magic, version, _ = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Not a map file")
+    if version > VERSION:
+        raise ValueError(f"Map file version {version} is newer than this app supports ({VERSION})")
+
+    while True:
+        head = f.read(CHUNK.size)
+        if not head:
+            return
+        if len(head) < CHUNK.size:
+            raise ValueError("Truncated map file")
+        tag, length = CHUNK.unpack(head)
+        payload = f.read(length)
+        if len(payload) < length:
+            raise ValueError("Truncated map file")
+        yield tag, payload
+        if tag == b"END!":
+            return
+
+
+def read_map(f):
+    """
+    Reads a binary map from `f` into the shape of MapState.to_dict().
+    """
+    data = {"items": [], "drawings": []}
+    strings = []
+    for tag, payload in iter_chunks(f):
+        if tag == b"META":
+            data.update(json.loads(payload.decode("utf-8")))
+        elif tag == b"STRS":
+            count = U32.unpack_from(payload, 0)[0]
+            pos = U32.size
+            for _ in range(count):
+                length = U16.unpack_from(payload, pos)[0]
+                pos += U16.size
+                strings.append(payload[pos:pos + length].decode("utf-8"))
+                pos += length
+        elif tag == b"ITEM":
+            data["items"].append(unpack_item(payload, strings))
+        elif tag == b"STRK":
+            data["drawings"].append(unpack_stroke(payload, strings))
+        # Unknown chunks come from newer minor revisions and are skipped
+    return data
+
+
+def convert(src, dst):
+    """
+    Converts a map between the JSON and binary formats; the format of `dst`
+    is picked by its extension.
+    """
+    if is_binary_map(src):
+        with open(src, "rb") as f:
+            data = read_map(f)
+    else:
+        with open(src, "r") as f:
+            data = json.load(f)
+
+    if dst.lower().endswith(EXTENSION):
+        with open(dst, "wb") as f:
+            write_map(f, data)
+    else:
+        with open(dst, "w") as f:
+            json.dump(data, f, indent=2, default=json_default)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python map_format.py <input map> <output map (.json or .lmap)>")
+        sys.exit(2)
+    convert(sys.argv[1], sys.argv[2])
@@ -1,8 +1,139 @@
 import json
+import sys
+from array import array
+from bisect import insort
+
+import map_format
+from grid import HexGrid, np
+
+def is_token_path(path):
+    p = path.lower()
+    return "token" in p or "frame" in p
+
+def size_class(scale):
+    # Lancer size an item was placed at, from its visual scale (size 1/2 is drawn at 0.8)
+    return max(1, round(scale))
+
+# Footprints, ranges and lines are in axial offsets, the same for any cell size or orientation
+FOOTPRINTS = HexGrid(flat_top=False)
+
+class MapItem:
+    """
+    One item on the map. The common fields are slots, anything else (stats,
+    custom_name, linked_file, faction...) lives in `extra`. Reads like the item
+    dict it replaces: item["hp"], item.get("markers", []), "hp" in item.
+
+    is_token and size_class are kept up to date when path / scale change.
+    """
+
+    __slots__ = ("path", "q", "r", "type", "scale", "rotation", "markers", "is_token", "size_class", "absent", "extra")
+
+    FIELDS = ("path", "q", "r", "type", "scale", "rotation", "markers")
+    DEFAULTS = {"type": "token", "scale": 1.0, "rotation": 0, "markers": ()}
+
+    def __init__(self, path, q, r, item_type="token", scale=1.0, rotation=0, markers=()):
+        self.q = q
+        self.r = r
+        self.type = item_type
+        self.rotation = rotation
+        self.markers = markers
+        # Optional fields the item was loaded or created without, left out of to_dict
+        self.absent = () if markers else ("markers",)
+        self.extra = None
+        self.set_path(path)
+        self.set_scale(scale)
+
+    @classmethod
+    def from_dict(cls, data):
+        if isinstance(data, MapItem):
+            return data
+        item = cls(data.get("path"), data.get("q"), data.get("r"))
+        for key, value in data.items():
+            item[key] = value
+        item.absent = tuple(k for k in cls.DEFAULTS if k not in data)
+        return item
+
+    def set_path(self, path):
+        self.path = sys.intern(path) if type(path) == str else path
+        self.is_token = is_token_path(path) if type(path) == str else False
+
+    def set_scale(self, scale):
+        self.scale = scale
+        self.size_class = size_class(scale)
+
+    def to_dict(self):
+        data = {k: getattr(self, k) for k in self.FIELDS if k not in self.absent}
+        if "markers" in data:
+            data["markers"] = list(data["markers"])
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key):
+        if key in self.DEFAULTS or key in ("path", "q", "r"):
+            if key in self.absent:
+                raise KeyError(key)
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key == "path":
+            self.set_path(value)
+        elif key == "scale":
+            self.set_scale(value)
+        elif key in self.DEFAULTS or key in ("q", "r"):
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+            return
+        if key in self.absent:
+            self.absent = tuple(k for k in self.absent if k != key)
+
+    def __contains__(self, key):
+        if key in self.DEFAULTS or key in ("path", "q", "r"):
+            return key not in self.absent
+        return self.extra is not None and key in self.extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, fields):
+        for key, value in fields.items():
+            self[key] = value
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __eq__(self, other):
+        if isinstance(other, MapItem):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    # Equal items are still different items, the index and journal go by identity
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return f"MapItem({self.to_dict()!r})"
 
 class MapState:
     def __init__(self):
-        self.items = []  # List of dicts: { "type": "token"|"tile", "path": str, "q": int, "r": int, "s": float, "rot": int }
+        self.items = []  # MapItems, bottom-most first
+        # Same order as items, for bulk queries without touching every record
+        self.qs = array("i")
+        self.rs = array("i")
+        self.scales = array("d")
         self.drawings = [] # List of dicts for paint tools
         self.background_color = "#000000"
         self.grid_size = 50
@@ -14,29 +145,202 @@ class MapState:
         self.ui_fg_color = "#39ff14"
         self.tokens_directory = None
         self.markers_directory = None
+        self._hex_index = {} # (q, r) -> sorted indices of the items covering that hex
+        self.journal = None # Autosave journal every change is recorded to, see journal.py
+        self.watchers = [] # Told which hexes changed, see _changed
+
+    def _changed(self, hexes):
+        # `hexes` had an item added, removed or edited; None if the whole map was replaced
+        for watcher in self.watchers:
+            watcher.map_changed(hexes)
+
+    def _record(self, op, **args):
+        if self.journal is not None:
+            self.journal.record(op, **args)
+
+    def _snapshot(self):
+        # The whole map changed at once, start the autosave over from it
+        if self.journal is not None:
+            self.journal.compact()
 
     def add_item(self, path, q, r, item_type="token", scale=1.0, rotation=0):
-        self.items.append({
-            "path": path,
-            "q": q,
-            "r": r,
-            "type": item_type,
-            "scale": scale,
-            "rotation": rotation
-        })
+        self.append_item(MapItem(path, q, r, item_type, scale, rotation))
+
+    def append_item(self, item):
+        # Adds a MapItem (or item dict) on top of the others
+        item = MapItem.from_dict(item)
+        self.items.append(item)
+        self.qs.append(item.q)
+        self.rs.append(item.r)
+        self.scales.append(item.scale)
+        self._index_add(len(self.items) - 1)
+        self._record("add", item=item.to_dict())
+
+    def move_item(self, index, q, r):
+        item = self.items[index]
+        if item.q == q and item.r == r:
+            return
+        self._index_remove(index)
+        item.q = q
+        item.r = r
+        self.qs[index] = q
+        self.rs[index] = r
+        self._index_add(index)
+        self._record("move", index=index, q=q, r=r)
+
+    def delete_item(self, index):
+        self._index_remove(index)
+        del self.items[index]
+        del self.qs[index]
+        del self.rs[index]
+        del self.scales[index]
+        # Every later index shifts down by one, the buckets stay sorted
+        for bucket in self._hex_index.values():
+            if bucket[-1] > index:
+                bucket[:] = [i - 1 if i > index else i for i in bucket]
+        self._record("delete", index=index)
+
+    def update_item(self, index, **fields):
+        # Stats, markers, name, faction, linked file... anything but the position
+        item = self.items[index]
+        if "scale" in fields:
+            # Footprint changes with the scale
+            self._index_remove(index)
+            item.update(fields)
+            self.scales[index] = item.scale
+            self._index_add(index)
+        else:
+            item.update(fields)
+            self._changed(self.item_hexes(item))
+        self._record("set", index=index, fields=fields)
+
+    def finish_stroke(self, line):
+        # `line` is already in drawings while it is drawn, it is recorded once complete
+        self._record("stroke", line=line)
+
+    def clear_drawings(self):
+        self.drawings = []
+        self._record("clear_paint")
+
+    def update_settings(self, **values):
+        # Map-wide settings: grid, colors, background, asset directories
+        for name, value in values.items():
+            setattr(self, name, value)
+        self._record("settings", values=values)
 
     def remove_item_at(self, q, r):
         # Remove top-most item at coordinates
-        for i in range(len(self.items) - 1, -1, -1):
-            if self.items[i]["q"] == q and self.items[i]["r"] == r:
-                del self.items[i]
-                return True
-        return False
+        index = self.item_at(q, r)
+        if index is None:
+            return False
+        self.delete_item(index)
+        return True
+
+    def items_at(self, q, r):
+        """Indices of the items covering hex (q, r), bottom-most first."""
+        return self._hex_index.get((q, r), [])
+
+    def item_at(self, q, r, tokens_only=False):
+        """Index of the top-most item covering hex (q, r), or None."""
+        for index in reversed(self.items_at(q, r)):
+            if not tokens_only or self.items[index].is_token:
+                return index
+        return None
+
+    def item_extents(self, grid):
+        """
+        (xs, ys, reaches) of every item in item order, from the position arrays:
+        its center in world pixels of `grid` (grid offset included) and half its
+        drawn width. numpy arrays when numpy is there, lists otherwise.
+        """
+        half = grid.width / 2
+        gx, gy = self.grid_offset_x, self.grid_offset_y
+        if np is not None and self.items:
+            xs, ys = grid.hex_to_pixel_array(np.frombuffer(self.qs, dtype=np.int32), np.frombuffer(self.rs, dtype=np.int32))
+            return xs + gx, ys + gy, np.frombuffer(self.scales, dtype=np.float64) * half
+        xs, ys = [], []
+        for q, r in zip(self.qs, self.rs):
+            x, y = grid.hex_to_pixel(q, r)
+            xs.append(x + gx)
+            ys.append(y + gy)
+        return xs, ys, [scale * half for scale in self.scales]
+
+    def items_rect(self, grid):
+        """
+        World rect (x0, y0, x1, y1) covered by the items, or None if there are none.
+        """
+        if not self.items:
+            return None
+        xs, ys, reaches = self.item_extents(grid)
+        if np is not None:
+            return (float((xs - reaches).min()), float((ys - reaches).min()),
+                    float((xs + reaches).max()), float((ys + reaches).max()))
+        return (min(x - r for x, r in zip(xs, reaches)), min(y - r for y, r in zip(ys, reaches)),
+                max(x + r for x, r in zip(xs, reaches)), max(y + r for y, r in zip(ys, reaches)))
+
+    def indices_in_rect(self, grid, rect, pad=0):
+        """
+        Indices of the items drawn (at least partly) inside world rect
+        (x0, y0, x1, y1), with `pad` world pixels of slack, in item order.
+        """
+        x0, y0, x1, y1 = rect
+        xs, ys, reaches = self.item_extents(grid)
+        if np is not None and self.items:
+            reaches = reaches + pad
+            mask = (xs + reaches > x0) & (xs - reaches < x1) & (ys + reaches > y0) & (ys - reaches < y1)
+            return np.flatnonzero(mask).tolist()
+        return [
+            i for i, (x, y, reach) in enumerate(zip(xs, ys, reaches))
+            if x + reach + pad > x0 and x - reach - pad < x1 and y + reach + pad > y0 and y - reach - pad < y1
+        ]
+
+    def item_hexes(self, item):
+        return FOOTPRINTS.footprint_hexes(item.q, item.r, item.size_class)
+
+    def overlapping(self, q, r, size, ignore=None):
+        """
+        Indices of the items whose footprint overlaps that of a size `size`
+        item anchored at (q, r), other than `ignore`.
+        """
+        found = set()
+        for h in FOOTPRINTS.footprint_hexes(q, r, size):
+            found.update(self._hex_index.get(h, ()))
+        found.discard(ignore)
+        return sorted(found)
+
+    def rebuild_index(self):
+        # Also rebuilds the position arrays from the items
+        self.qs = array("i", [item.q for item in self.items])
+        self.rs = array("i", [item.r for item in self.items])
+        self.scales = array("d", [item.scale for item in self.items])
+        self._hex_index = {}
+        for index, item in enumerate(self.items):
+            for h in self.item_hexes(item):
+                self._hex_index.setdefault(h, []).append(index)
+        self._changed(None)
+
+    def _index_add(self, index):
+        hexes = self.item_hexes(self.items[index])
+        for h in hexes:
+            insort(self._hex_index.setdefault(h, []), index)
+        self._changed(hexes)
+
+    def _index_remove(self, index):
+        hexes = self.item_hexes(self.items[index])
+        for h in hexes:
+            bucket = self._hex_index.get(h)
+            if bucket is not None:
+                bucket.remove(index)
+                if not bucket:
+                    del self._hex_index[h]
+        self._changed(hexes)
 
     def clear(self):
         self.items = []
         self.drawings = []
         self.background_image = None
+        self.rebuild_index()
+        self._snapshot()
 
     def to_dict(self):
         return {
@@ -50,18 +354,30 @@ class MapState:
             "markers_directory": self.markers_directory,
             "grid_offset_x": self.grid_offset_x,
             "grid_offset_y": self.grid_offset_y,
-            "items": self.items,
+            "items": [item.to_dict() for item in self.items],
             "drawings": self.drawings
         }
 
     def save_to_file(self, filepath):
+        # .lmap files get the binary format, anything else JSON
+        if filepath.lower().endswith(map_format.EXTENSION):
+            with open(filepath, 'wb') as f:
+                map_format.write_map(f, self.to_dict())
+            return
         with open(filepath, 'w') as f:
-            json.dump(self.to_dict(), f, indent=2)
+            json.dump(self.to_dict(), f, indent=2, default=map_format.json_default)
 
     def load_from_file(self, filepath):
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-        
+        if map_format.is_binary_map(filepath):
+            with open(filepath, 'rb') as f:
+                data = map_format.read_map(f)
+        else:
+            with open(filepath, 'r') as f:
+                data = json.load(f)
+        self.load_from_dict(data)
+        self._snapshot()
+
+    def load_from_dict(self, data):
         self.background_color = data.get("background_color", "#000000")
         self.background_image = data.get("background_image", None)
         self.grid_size = data.get("grid_size", 50)
@@ -72,5 +388,6 @@ class MapState:
         self.markers_directory = data.get("markers_directory", None)
         self.grid_offset_x = data.get("grid_offset_x", 0)
         self.grid_offset_y = data.get("grid_offset_y", 0)
-        self.items = data.get("items", [])
+        self.items = [MapItem.from_dict(item) for item in data.get("items", [])]
         self.drawings = data.get("drawings", [])
+        self.rebuild_index()
@@ -0,0 +1,245 @@
+"""
+Movement over the hex map, in axial coordinates.
+
+A token can't enter hexes under a blocking tile or a token of another
+faction, and can pass through tokens of its own faction without stopping
+there. Difficult tiles cost 2 movement per hex. Large tokens move by their
+anchor hex and have to fit their whole footprint at every step.
+"""
+import heapq
+
+from grid import DIRECTIONS, hex_distance
+from map_state import FOOTPRINTS
+
+# Tiles are sorted by their file name
+BLOCKING_WORDS = ("wall", "obstacle", "block", "building", "cliff")
+DIFFICULT_WORDS = ("difficult", "rubble", "debris", "water", "forest", "swamp")
+
+# A* gives up after expanding this many hexes
+MAX_SEARCH = 20000
+
+
+def tile_cost(item):
+    """
+    Cost of entering a hex under tile `item`: None if it blocks movement, 2 for
+    difficult terrain, otherwise 1.
+    """
+    name = item.path.lower() if item.path else ""
+    if any(w in name for w in BLOCKING_WORDS):
+        return None
+    if any(w in name for w in DIFFICULT_WORDS):
+        return 2
+    return 1
+
+
+def token_speed(item):
+    speed = item.get("speed")
+    return speed if type(speed) == int else None
+
+
+class Terrain:
+    """
+    What the map looks like to one moving token. Every hex looked at is kept
+    in `explored`, which is what its cached results depend on.
+    """
+
+    def __init__(self, map_state, mover_index):
+        self.map_state = map_state
+        self.mover = mover_index
+        mover = map_state.items[mover_index]
+        self.faction = mover.get("faction", "Neutral")
+        self.footprint = FOOTPRINTS.footprint(mover.size_class)
+        self.hexes = {} # (q, r) -> (cost or None, can stop)
+        self.explored = set()
+
+    def hex_info(self, h):
+        info = self.hexes.get(h)
+        if info is not None:
+            return info
+        self.explored.add(h)
+        cost = 1
+        can_stop = True
+        items = self.map_state.items
+        for index in self.map_state.items_at(*h):
+            if index == self.mover:
+                continue
+            item = items[index]
+            if item.is_token:
+                can_stop = False
+                if item.get("faction", "Neutral") != self.faction:
+                    cost = None
+                    break
+            else:
+                c = tile_cost(item)
+                if c is None:
+                    cost = None
+                    break
+                cost = max(cost, c)
+        info = (cost, can_stop)
+        self.hexes[h] = info
+        return info
+
+    def step(self, q, r):
+        """
+        (cost, can stop) of moving the token's anchor to (q, r): the worst of
+        the hexes its footprint would cover there.
+        """
+        cost = 1
+        can_stop = True
+        for dq, dr in self.footprint:
+            c, stop = self.hex_info((q + dq, r + dr))
+            if c is None:
+                return None, False
+            cost = max(cost, c)
+            can_stop = can_stop and stop
+        return cost, can_stop
+
+
+class MoveRange:
+    """
+    Result of a movement search from a token's position: the hexes it can end
+    its move on with what they cost, and the shortest way to each of them.
+    """
+
+    def __init__(self, start, costs, came_from, explored):
+        self.start = start
+        self.costs = costs # (q, r) -> movement spent, stops only
+        self.came_from = came_from
+        self.explored = explored
+
+    def path_to(self, goal):
+        if goal not in self.costs:
+            return None
+        path = [goal]
+        while path[-1] != self.start:
+            path.append(self.came_from[path[-1]])
+        path.reverse()
+        return path
+
+
+def reachable(map_state, index, speed=None):
+    """
+    Dijkstra over the hexes the token at `index` can reach with `speed`
+    movement (its speed stat by default). Returns a MoveRange.
+    """
+    item = map_state.items[index]
+    if speed is None:
+        speed = token_speed(item) or 0
+    terrain = Terrain(map_state, index)
+    start = (item.q, item.r)
+    terrain.step(*start)
+
+    dist = {start: 0}
+    came_from = {}
+    heap = [(0, start)]
+    while heap:
+        d, (q, r) = heapq.heappop(heap)
+        if d > dist[(q, r)]:
+            continue
+        for dq, dr in DIRECTIONS:
+            n = (q + dq, r + dr)
+            cost, _ = terrain.step(*n)
+            if cost is None:
+                continue
+            nd = d + cost
+            if nd <= speed and nd < dist.get(n, speed + 1):
+                dist[n] = nd
+                came_from[n] = (q, r)
+                heapq.heappush(heap, (nd, n))
+
+    # Hexes it can only pass through are still needed to walk paths back
+    costs = {h: d for h, d in dist.items() if h == start or terrain.step(*h)[1]}
+    return MoveRange(start, costs, came_from, terrain.explored)
+
+
+def find_path(map_state, index, goal, max_cost=None):
+    """
+    A* from the token at `index` to anchor hex `goal`, with the hex distance
+    as heuristic (every step costs at least 1). Returns (path, cost), or
+    (None, None) if the goal can't be reached (within `max_cost`).
+    """
+    item = map_state.items[index]
+    terrain = Terrain(map_state, index)
+    start = (item.q, item.r)
+    goal = tuple(goal)
+    if goal == start:
+        return [start], 0
+    cost, can_stop = terrain.step(*goal)
+    if cost is None or not can_stop:
+        return None, None
+
+    dist = {start: 0}
+    came_from = {}
+    heap = [(hex_distance(*start, *goal), 0, start)]
+    expanded = 0
+    while heap:
+        _, d, h = heapq.heappop(heap)
+        if h == goal:
+            path = [h]
+            while path[-1] != start:
+                path.append(came_from[path[-1]])
+            path.reverse()
+            return path, d
+        if d > dist[h]:
+            continue
+        expanded += 1
+        if expanded > MAX_SEARCH:
+            break
+        for dq, dr in DIRECTIONS:
+            n = (h[0] + dq, h[1] + dr)
+            cost, _ = terrain.step(*n)
+            if cost is None:
+                continue
+            nd = d + cost
+            if max_cost is not None and nd > max_cost:
+                continue
+            if nd < dist.get(n, nd + 1):
+                dist[n] = nd
+                came_from[n] = h
+                heapq.heappush(heap, (nd + hex_distance(*n, *goal), nd, n))
+    return None, None
+
+
+class MovementCache:
+    """
+    Movement ranges per token, kept until something changes on a hex the
+    search looked at: moving one token only recomputes the ranges it could
+    have affected. Registers itself with the MapState for change notices.
+    """
+
+    def __init__(self, map_state):
+        self.map_state = map_state
+        self.ranges = {} # id(item) -> (item, speed, MoveRange)
+        map_state.watchers.append(self)
+
+    def reachable(self, index, speed=None):
+        item = self.map_state.items[index]
+        if speed is None:
+            speed = token_speed(item) or 0
+        cached = self.ranges.get(id(item))
+        if cached is not None and cached[0] is item and cached[1] == speed:
+            return cached[2]
+        result = reachable(self.map_state, index, speed)
+        self.ranges[id(item)] = (item, speed, result)
+        return result
+
+    def find_path(self, index, goal):
+        # Within the token's speed the cached range already has the shortest path
+        move_range = self.reachable(index)
+        path = move_range.path_to(tuple(goal))
+        if path is not None:
+            return path, move_range.costs[path[-1]]
+        return find_path(self.map_state, index, goal)
+
+    def map_changed(self, hexes):
+        """
+        Called by MapState with the hexes whose occupants changed, or None
+        when the whole map was replaced.
+        """
+        if hexes is None:
+            self.ranges = {}
+            return
+        hexes = set(hexes)
+        for key, (_, _, move_range) in list(self.ranges.items()):
+            if not hexes.isdisjoint(move_range.explored):
+                del self.ranges[key]
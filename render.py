@@ -0,0 +1,170 @@
+"""
+Off-screen map renderer.
+
+Composites a MapState into a PIL image the same way the canvas draws it
+(background, hex grid, tiles, paint, tokens and their markers), at any
+scale and for any world rect. Needs neither Tk nor a display, so it can be
+used for exports, batch jobs and tests.
+"""
+import math
+
+from PIL import Image, ImageColor, ImageDraw
+
+from background import open_background
+from grid import HexGrid
+from grid_layer import render_grid
+
+
+class FileImageLoader:
+    """
+    Minimal image source for render_map when no SourceImageCache is shared.
+    """
+
+    def __init__(self):
+        self.images = {}
+
+    def size_of(self, path):
+        img = self.load(path)
+        return img.size if img else None
+
+    def load_for_size(self, path, display_w, display_h):
+        return self.load(path)
+
+    def load(self, path):
+        if path not in self.images:
+            try:
+                with Image.open(path) as f:
+                    self.images[path] = f.copy()
+            except Exception as e:
+                print(f"Error loading image {path}: {e}")
+                self.images[path] = None
+        return self.images[path]
+
+
+def map_bounds(map_state, grid, background=None, margin=1):
+    """
+    World rect (x0, y0, x1, y1) of everything on the map: the background
+    image if there is one, plus every item and stroke, padded by `margin` hexes.
+    """
+    xs, ys = [], []
+    if background is not None:
+        xs += [0, background.size[0]]
+        ys += [0, background.size[1]]
+    pad = grid.width * margin
+    if map_state.items:
+        x0, y0, x1, y1 = map_state.items_rect(grid)
+        xs += [x0 - pad, x1 + pad]
+        ys += [y0 - pad, y1 + pad]
+    for line in map_state.drawings:
+        for p in line["points"]:
+            xs.append(p["x"])
+            ys.append(p["y"])
+    if not xs:
+        # Empty map: a few hexes around the origin
+        return (-pad * 5, -pad * 5, pad * 5, pad * 5)
+    if background is None or map_state.items or map_state.drawings:
+        return (min(xs), min(ys), max(xs), max(ys))
+    return (0, 0, background.size[0], background.size[1])
+
+
+def render_map(map_state, grid=None, scale=1.0, rect=None, images=None, mode="GUSTAV_NHP", background_color=None):
+    """
+    Renders `map_state` into an RGBA image.
+
+    grid: HexGrid to lay items out on (defaults to the app's pointy-top grid of map_state.grid_size)
+    scale: output pixels per world unit
+    rect: world rect (x0, y0, x1, y1) to render, defaults to map_bounds()
+    images: object with size_of(path) / load_for_size(path, w, h), e.g. a SourceImageCache
+    mode: app mode, "WEBER_NHP" restricts the grid to the background like the canvas does
+    """
+    if grid is None:
+        grid = HexGrid(size=map_state.grid_size, flat_top=False)
+    if images is None:
+        images = FileImageLoader()
+
+    background = open_background(map_state.background_image, wait=True) if map_state.background_image else None
+    if rect is None:
+        rect = map_bounds(map_state, grid, background)
+    x0, y0, x1, y1 = rect
+    width = max(1, math.ceil((x1 - x0) * scale))
+    height = max(1, math.ceil((y1 - y0) * scale))
+
+    color = background_color or map_state.ui_bg_color
+    out = Image.new("RGBA", (width, height), ImageColor.getrgb(color))
+
+    def to_image(wx, wy):
+        return (wx - x0) * scale, (wy - y0) * scale
+
+    gx = map_state.grid_offset_x
+    gy = map_state.grid_offset_y
+
+    # Background
+    if background is not None:
+        crop = background.crop_rect(rect, margin=0)
+        if crop:
+            bg_img = background.render(crop, scale).convert("RGBA")
+            px, py = to_image(crop[0], crop[1])
+            out.paste(bg_img, (round(px), round(py)), bg_img)
+
+    # Grid, relative to the grid origin
+    grid_rect = (x0 - gx, y0 - gy, x1 - gx, y1 - gy)
+    clip = None
+    if mode == "WEBER_NHP" and background is not None:
+        margin = grid.size
+        clip = (-margin - gx, -margin - gy, background.size[0] + margin - gx, background.size[1] + margin - gy)
+    grid_img = render_grid(grid, scale, map_state.grid_color, grid_rect, clip)
+    out.alpha_composite(grid_img.crop((0, 0, width, height)))
+
+    # Items: tiles, then paint, then tokens
+    tiles = [item for item in map_state.items if not item.is_token]
+    tokens = [item for item in map_state.items if item.is_token]
+
+    def paste_centered(img, cx, cy):
+        img = img.convert("RGBA")
+        out.paste(img, (round(cx - img.width / 2), round(cy - img.height / 2)), img)
+
+    def draw_item(item):
+        size = images.size_of(item.path)
+        if not size or size[0] == 0:
+            return
+        wx, wy = grid.hex_to_pixel(item.q, item.r)
+        sx, sy = to_image(wx + gx, wy + gy)
+
+        display_w = int(grid.width * scale * item.scale)
+        display_h = int(display_w * size[1] / size[0])
+        if display_w <= 0 or display_h <= 0:
+            return
+        # Skip what is entirely outside the output
+        if sx + display_w < 0 or sy + display_h < 0 or sx - display_w > width or sy - display_h > height:
+            return
+        img = images.load_for_size(item.path, display_w, display_h)
+        if img is None:
+            return
+        paste_centered(img.resize((display_w, display_h), Image.Resampling.NEAREST), sx, sy)
+
+        markers = item.markers
+        if markers:
+            marker_size = max(16, int(display_w * 0.35))
+            total_w = (len(markers) - 1) * marker_size * 1.1
+            start_x = sx - total_w / 2
+            m_y = sy + display_h / 2
+            for i, m_path in enumerate(markers):
+                m_img = images.load_for_size(m_path, marker_size, marker_size)
+                if m_img is not None:
+                    m_x = start_x + i * marker_size * 1.1
+                    paste_centered(m_img.resize((marker_size, marker_size), Image.Resampling.LANCZOS), m_x, m_y)
+
+    for item in tiles:
+        draw_item(item)
+
+    draw = ImageDraw.Draw(out)
+    line_width = max(1, round(3 * scale))
+    for line in map_state.drawings:
+        if len(line["points"]) > 1:
+            pts = [to_image(p["x"], p["y"]) for p in line["points"]]
+            draw.line(pts, fill=line.get("color", "white"), width=line_width, joint="curve")
+
+    for item in tokens:
+        draw_item(item)
+
+    return out
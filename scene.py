@@ -0,0 +1,209 @@
+import time
+
+
+class CanvasScene:
+    """
+    Retained set of canvas items for the map view.
+
+    Every drawn object (background, hex cell, map item, paint stroke) is an
+    entry keyed by the caller. An entry remembers its canvas tag, a signature
+    of how it looks and the world position it was laid out at, so a frame only
+    touches the entries that actually changed.
+    """
+
+    # Bottom to top
+    LAYERS = ("background", "grid", "tile", "paint", "range", "token")
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.entries = {}  # key -> { "tag": str, "layer": str, "sig": any, "pos": (wx, wy), "refs": list }
+        self.layout_key = None
+        self.camera_x = 0
+        self.camera_y = 0
+        self.scale = 1.0
+        self.center_x = 0  # Screen position of the camera
+        self.center_y = 0
+        self._next_tag = 0
+        self._seen = set()
+        self._restack = False
+
+    def begin_frame(self, layout_key, camera_x, camera_y, scale, center_x, center_y):
+        """
+        Starts a frame. Returns True if everything has to be laid out again
+        (zoom, grid settings or canvas size changed), otherwise the existing
+        items are translated to the new camera position with a single move.
+        """
+        self._seen = set()
+        if layout_key != self.layout_key:
+            self.clear()
+            self.layout_key = layout_key
+            self.camera_x, self.camera_y, self.scale = camera_x, camera_y, scale
+            self.center_x, self.center_y = center_x, center_y
+            return True
+
+        dx = (self.camera_x - camera_x) * self.scale
+        dy = (self.camera_y - camera_y) * self.scale
+        if dx or dy:
+            self.canvas.move("scene", dx, dy)
+        self.camera_x, self.camera_y = camera_x, camera_y
+        return False
+
+    def to_screen(self, wx, wy):
+        # Where world point (wx, wy) currently is on the canvas
+        return (wx - self.camera_x) * self.scale + self.center_x, (wy - self.camera_y) * self.scale + self.center_y
+
+    def end_frame(self, layers=LAYERS):
+        # Drop whatever was not drawn this frame, in the layers that were drawn
+        for key, entry in list(self.entries.items()):
+            if key not in self._seen and entry["layer"] in layers:
+                self.remove(key)
+        if self._restack:
+            for layer in self.LAYERS:
+                self.canvas.tag_raise(layer)
+            self._restack = False
+
+    def clear(self):
+        self.canvas.delete("scene")
+        self.entries = {}
+        self.layout_key = None
+
+    def keep(self, key, sig, pos):
+        """
+        Marks `key` as drawn this frame. If it already exists with the same
+        signature it is moved to `pos` (if needed) and True is returned.
+        Returns False when the caller has to (re)create it with `put`.
+        """
+        self._seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None or entry["sig"] != sig:
+            return False
+        if entry["pos"] != pos:
+            dx = (pos[0] - entry["pos"][0]) * self.scale
+            dy = (pos[1] - entry["pos"][1]) * self.scale
+            self.canvas.move(entry["tag"], dx, dy)
+            entry["pos"] = pos
+        return True
+
+    def new_tag(self):
+        self._next_tag += 1
+        return f"e{self._next_tag}"
+
+    def put(self, key, tag, layer, sig, pos, refs=None, below=None):
+        """
+        Registers the canvas items created under `tag` for `key`, replacing the
+        previous ones. The new items take the stacking position of the old ones,
+        or go right below the `below` tag when given.
+        """
+        self._seen.add(key)
+        old = self.entries.get(key)
+        if old is not None:
+            self.canvas.tag_lower(tag, old["tag"])
+            self.canvas.delete(old["tag"])
+        elif below is not None:
+            self.canvas.tag_lower(tag, below)
+        else:
+            self._restack = True
+        self.entries[key] = {"tag": tag, "layer": layer, "sig": sig, "pos": pos, "refs": refs or []}
+
+    def sig_of(self, key):
+        entry = self.entries.get(key)
+        return entry["sig"] if entry else None
+
+    def tag_of(self, key):
+        entry = self.entries.get(key)
+        return entry["tag"] if entry else None
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.canvas.delete(entry["tag"])
+
+
+class FrameScheduler:
+    """
+    Coalesces redraw requests into a single frame.
+
+    Requests only mark layers dirty; the frame runs once Tk is idle, and no
+    sooner than `interval` ms after the previous one, with every layer that
+    was requested in the meantime.
+    """
+
+    LAYERS = ("background", "grid", "items", "paint", "overlay")
+
+    def __init__(self, widget, draw, interval=16):
+        self.widget = widget
+        self.draw = draw  # Called with the set of dirty layers
+        self.interval = interval
+        self.dirty = set()
+        self._pending = None
+        self._last_frame = 0
+
+    def request(self, layers=None):
+        self.dirty.update(layers or self.LAYERS)
+        if self._pending is not None:
+            return
+        wait = self.interval - (time.monotonic() - self._last_frame) * 1000
+        if wait > 0:
+            self._pending = self.widget.after(int(wait) + 1, self._run)
+        else:
+            self._pending = self.widget.after_idle(self._run)
+
+    def flush(self):
+        # Run a pending frame right away
+        if self._pending is not None:
+            self.widget.after_cancel(self._pending)
+            self._run()
+
+    def _run(self):
+        self._pending = None
+        dirty, self.dirty = self.dirty, set()
+        self._last_frame = time.monotonic()
+        self.draw(dirty)
+
+
+class ActiveStroke:
+    """
+    Canvas lines of the paint stroke being drawn. Each new point extends the
+    last line in place; after CHUNK points a new line is started, so a point
+    costs the same however long the stroke already is.
+    """
+
+    CHUNK = 64
+
+    def __init__(self, canvas, color, tags=("scene", "paint")):
+        self.canvas = canvas
+        self.color = color
+        self.tags = tags
+        self.ids = []
+        self.chunk = []  # World points of the line being extended
+        self.item = None
+
+    def extend(self, wx, wy, to_screen):
+        self.chunk.append((wx, wy))
+        if len(self.chunk) < 2:
+            return
+        coords = []
+        for p in self.chunk:
+            coords.extend(to_screen(*p))
+        if self.item is None:
+            self.item = self.canvas.create_line(coords, fill=self.color, width=3, smooth=True, tags=self.tags)
+            self.ids.append(self.item)
+        else:
+            self.canvas.coords(self.item, *coords)
+        if len(self.chunk) >= self.CHUNK:
+            # Next line starts where this one ends
+            self.chunk = self.chunk[-1:]
+            self.item = None
+
+    def redraw(self, points, to_screen):
+        # After a re-layout the lines are gone, lay the whole stroke out again
+        self.delete()
+        for p in points:
+            self.extend(p["x"], p["y"], to_screen)
+
+    def delete(self):
+        for item in self.ids:
+            self.canvas.delete(item)
+        self.ids = []
+        self.chunk = []
+        self.item = None
@@ -0,0 +1,40 @@
+import math
+
+
+def simplify_stroke(points, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification of a paint stroke.
+    `points` is a list of {"x": .., "y": ..} dicts; points closer than
+    `tolerance` to the simplified line are dropped.
+    """
+    if len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first]["x"], points[first]["y"]
+        bx, by = points[last]["x"], points[last]["y"]
+        dx, dy = bx - ax, by - ay
+        length = math.hypot(dx, dy)
+
+        max_dist = -1
+        index = first
+        for i in range(first + 1, last):
+            px, py = points[i]["x"], points[i]["y"]
+            if length == 0:
+                dist = math.hypot(px - ax, py - ay)
+            else:
+                dist = abs(dy * px - dx * py + bx * ay - by * ax) / length
+            if dist > max_dist:
+                max_dist = dist
+                index = i
+
+        if max_dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [p for p, k in zip(points, keep) if k]
@@ -0,0 +1,68 @@
+import pytest
+
+from aoe import (BLAST, BURST, CONE, LINE, blast_hexes, burst_hexes, cone_hexes, line_hexes,
+                 resolve, template_hexes, tokens_in)
+from grid import DIRECTIONS, hex_distance
+from map_state import FOOTPRINTS, MapState
+
+# Template sizes must not depend on where they are aimed
+AIMS = DIRECTIONS + ((3, 3), (5, -1), (-2, 7), (1, 1), (-4, -4), (2, -7))
+
+
+@pytest.mark.parametrize("size", range(1, 9))
+def test_cone_sizes(size):
+    for aim in AIMS:
+        cone = cone_hexes(0, 0, aim[0], aim[1], size)
+        assert len(cone) == size * (size + 1) // 2, aim
+        far = [h for h in cone if hex_distance(0, 0, *h) == size]
+        assert len(far) == size, aim
+
+
+@pytest.mark.parametrize("size", range(1, 9))
+def test_line_sizes(size):
+    for aim in AIMS:
+        line = line_hexes(0, 0, aim[0], aim[1], size)
+        assert len(line) == size, aim
+        assert max(hex_distance(0, 0, *h) for h in line) == size
+
+
+@pytest.mark.parametrize("size", range(1, 9))
+def test_blast_and_burst_sizes(size):
+    assert len(blast_hexes(0, 0, size)) == 3 * size * (size + 1) + 1
+    assert len(burst_hexes(0, 0, size)) == 3 * size * (size + 1)
+
+
+def test_aim_on_the_attacker():
+    assert cone_hexes(2, 2, 2, 2, 3) == set()
+    assert line_hexes(2, 2, 2, 2, 3) == set()
+    with pytest.raises(ValueError):
+        template_hexes(CONE, 3, (0, 0))
+
+
+def test_large_attackers():
+    footprint = set(FOOTPRINTS.footprint_hexes(0, 0, 3))
+    for kind in (BURST, CONE, LINE):
+        hexes = template_hexes(kind, 2, (0, 0), (5, 0), origin_size=3)
+        assert hexes and hexes.isdisjoint(footprint)
+    # A burst reaches 2 hexes out from every hex of the footprint
+    burst = template_hexes(BURST, 2, (0, 0), origin_size=3)
+    assert all(min(hex_distance(*h, *f) for f in footprint) <= 2 for h in burst)
+    assert len(burst) == len(FOOTPRINTS.hex_range(0, 0, 3)) - len(footprint)
+
+
+def test_resolve():
+    state = MapState()
+    state.add_item("tokens/attacker.png", 0, 0)
+    state.add_item("tokens/near.png", 2, 0)
+    state.add_item("tokens/far.png", 5, 0)
+    state.add_item("tiles/crate.png", 1, 0, "tile")
+    state.add_item("tokens/big.png", 0, -6, scale=2.0)
+
+    hexes, targets = resolve(state, BLAST, 1, 0, aim=(2, 0))
+    assert (2, 0) in hexes and targets == [1]
+    # The attacker is never its own target, tiles are never targets
+    assert resolve(state, BURST, 2, 0)[1] == [1]
+    assert resolve(state, LINE, 5, 0, aim=(1, 0))[1] == [1, 2]
+    # Large tokens are hit on any hex of their footprint
+    big = set(FOOTPRINTS.footprint_hexes(0, -6, 2))
+    assert tokens_in(state, big - {(0, -6)}) == [4]
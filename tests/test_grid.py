@@ -0,0 +1,63 @@
+import pytest
+
+from grid import DIRECTIONS, HexGrid, hex_distance
+
+
+@pytest.fixture
+def grid():
+    return HexGrid(size=50, flat_top=False)
+
+
+@pytest.mark.parametrize("size, count", [(0.5, 1), (1, 1), (2, 3), (3, 7), (4, 12)])
+def test_footprint_sizes(grid, size, count):
+    offsets = grid.footprint(size)
+    assert len(offsets) == count
+    assert len(set(offsets)) == count
+    assert (0, 0) in offsets
+
+
+def test_footprint_hexes(grid):
+    assert sorted(grid.footprint_hexes(4, -2, 2)) == sorted((4 + dq, -2 + dr) for dq, dr in grid.footprint(2))
+
+
+@pytest.mark.parametrize("radius", range(6))
+def test_hex_range(grid, radius):
+    hexes = grid.hex_range(3, -1, radius)
+    assert len(hexes) == len(set(hexes)) == 3 * radius * (radius + 1) + 1
+    assert all(hex_distance(3, -1, q, r) <= radius for q, r in hexes)
+
+
+@pytest.mark.parametrize("radius", range(1, 6))
+def test_hex_ring(grid, radius):
+    ring = grid.hex_ring(0, 0, radius)
+    assert len(ring) == len(set(ring)) == 6 * radius
+    assert all(hex_distance(0, 0, q, r) == radius for q, r in ring)
+
+
+@pytest.mark.parametrize("end", [(0, 0), (1, 0), (5, 0), (3, 3), (-4, 1), (2, -7), (-6, 6), (7, -2)])
+def test_hex_line(grid, end):
+    n = hex_distance(1, 2, 1 + end[0], 2 + end[1])
+    for nudge in (1e-6, -1e-6):
+        line = grid.hex_line(1, 2, 1 + end[0], 2 + end[1], nudge)
+        assert len(line) == n + 1
+        assert line[0] == (1, 2)
+        assert line[-1] == (1 + end[0], 2 + end[1])
+        # Every step goes to a neighbor
+        for a, b in zip(line, line[1:]):
+            assert hex_distance(*a, *b) == 1
+
+
+def test_hex_line_sides_of_a_tie(grid):
+    # (2, -1) runs along the edge between two hexes, the nudge picks the side
+    a = grid.hex_line(0, 0, 2, -1, 1e-6)
+    b = grid.hex_line(0, 0, 2, -1, -1e-6)
+    assert a[1] != b[1]
+    assert a[1] in DIRECTIONS
+    assert b[1] in DIRECTIONS
+
+
+def test_pixel_round_trip():
+    for flat_top in (True, False):
+        grid = HexGrid(size=37, flat_top=flat_top)
+        for q, r in grid.hex_range(0, 0, 4):
+            assert grid.pixel_to_hex(*grid.hex_to_pixel(q, r)) == (q, r)
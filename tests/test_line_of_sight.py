@@ -0,0 +1,74 @@
+from line_of_sight import BLOCKED, CLEAR, HARD, SOFT, VisibilityMatrix
+from map_state import MapState
+
+
+def make_map():
+    # Three tokens in a row along r = 0, one off to the side
+    state = MapState()
+    state.add_item("tokens/a.png", 0, 0)
+    state.add_item("tokens/b.png", 4, 0)
+    state.add_item("tokens/c.png", 8, 0)
+    state.add_item("tokens/d.png", 0, 4)
+    return state
+
+
+def test_cover_levels():
+    for path, level in [
+        ("tiles/floor.png", CLEAR),
+        ("tiles/smoke.png", SOFT),
+        ("tiles/soft_cover.png", SOFT),
+        ("tiles/crate.png", HARD),
+        ("tiles/wall.png", BLOCKED),
+    ]:
+        state = make_map()
+        state.add_item(path, 2, 0, "tile")
+        matrix = VisibilityMatrix(state)
+        assert matrix.cover(0, 1) == level, path
+        assert matrix.can_see(0, 1) == (level != BLOCKED)
+
+
+def test_wall_needs_to_cover_every_line():
+    # A single wall hex on a corner tie leaves the line on the other side clear
+    state = MapState()
+    state.add_item("tokens/a.png", 0, 0)
+    state.add_item("tokens/b.png", 2, -1)
+    state.add_item("tiles/wall.png", 1, 0, "tile")
+    assert VisibilityMatrix(state).cover(0, 1) == CLEAR
+    state.add_item("tiles/wall.png", 1, -1, "tile")
+    assert VisibilityMatrix(state).cover(0, 1) == BLOCKED
+
+
+def test_invalidated_by_moves():
+    state = make_map()
+    state.add_item("tiles/wall.png", 6, 0, "tile")
+    matrix = VisibilityMatrix(state)
+    before = matrix.all_pairs()
+    assert before[(0, 1)] == CLEAR and before[(1, 2)] == BLOCKED
+
+    # b steps behind the wall: every pair with b changes, a and d don't
+    state.move_item(1, 7, 0)
+    after = matrix.all_pairs()
+    assert after == VisibilityMatrix(state).all_pairs()
+    assert after[(1, 2)] == CLEAR and after[(0, 1)] == BLOCKED
+    assert after[(0, 3)] == before[(0, 3)]
+
+    # Tiles placed and removed on a sight line
+    state.add_item("tiles/crate.png", 0, 2, "tile")
+    assert matrix.cover(0, 3) == HARD
+    state.delete_item(len(state.items) - 1)
+    assert matrix.cover(0, 3) == CLEAR
+
+    state.load_from_dict(state.to_dict())
+    assert matrix.all_pairs() == VisibilityMatrix(state).all_pairs()
+
+
+def test_only_touched_pairs_are_dropped():
+    state = make_map()
+    matrix = VisibilityMatrix(state)
+    matrix.all_pairs()
+    # d moving doesn't touch the line between b and c
+    key = tuple(sorted((id(state.items[1]), id(state.items[2]))))
+    kept = matrix.pairs[key]
+    state.move_item(3, 0, 5)
+    assert matrix.pairs.get(key) is kept
+    assert len(matrix.pairs) == 3
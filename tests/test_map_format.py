@@ -0,0 +1,98 @@
+import io
+import json
+
+import pytest
+
+import map_format
+from map_format import PackedPoints, read_map, write_map
+from map_state import MapState
+
+
+def sample_map():
+    return {
+        "background_image": None,
+        "background_color": "#000000",
+        "grid_size": 50,
+        "grid_color": "#39ff14",
+        "ui_bg_color": "#000000",
+        "ui_fg_color": "#39ff14",
+        "tokens_directory": "assets/tokens",
+        "markers_directory": None,
+        "grid_offset_x": 12,
+        "grid_offset_y": -4,
+        "items": [
+            {"path": "assets/tokens/mech.png", "q": 3, "r": -2, "type": "token", "scale": 2.0,
+             "markers": ["assets/markers/burn.png", "assets/markers/burn.png"],
+             "linked_file": "sheets/mech.json", "faction": "Enemy", "hp": 12},
+            {"path": "assets/tiles/wall.png", "q": -7, "r": 0},
+            {"path": "assets/tiles/crate.png", "q": 1, "r": 1, "type": "tile", "markers": []},
+            # Doesn't fit the ITEM layout and is stored as JSON
+            {"path": "assets/tiles/odd.png", "q": 2.5, "r": 0},
+        ],
+        "drawings": [
+            # Points that float32 holds exactly
+            {"color": "red", "points": [{"x": 0.5, "y": 1.25}, {"x": -8.0, "y": 1024.0}]},
+            {"points": [{"x": 1.0, "y": 2.0}], "width": 3},
+        ],
+    }
+
+
+def round_trip(data, meta=None):
+    f = io.BytesIO()
+    write_map(f, data, meta)
+    f.seek(0)
+    return read_map(f)
+
+
+def test_round_trip():
+    data = sample_map()
+    loaded = round_trip(data)
+    assert loaded == data
+    assert isinstance(loaded["drawings"][0]["points"], PackedPoints)
+
+
+def test_meta_is_returned():
+    loaded = round_trip(sample_map(), {"exported_by": "batch"})
+    assert loaded["exported_by"] == "batch"
+
+
+def test_points_are_float32():
+    data = sample_map()
+    data["drawings"] = [{"color": "red", "points": [{"x": 0.1, "y": 2.0}]}]
+    point = round_trip(data)["drawings"][0]["points"][0]
+    assert point["x"] != 0.1 and abs(point["x"] - 0.1) < 1e-6
+    assert point["y"] == 2.0
+
+
+def test_packed_points_write_as_json():
+    points = round_trip(sample_map())["drawings"][0]["points"]
+    text = json.dumps(points, default=map_format.json_default)
+    assert json.loads(text) == [{"x": 0.5, "y": 1.25}, {"x": -8.0, "y": 1024.0}]
+    # And back into .lmap without unpacking them
+    again = round_trip({"items": [], "drawings": [{"points": points}]})
+    assert again["drawings"][0]["points"] == points
+
+
+def test_map_state_files(tmp_path):
+    data = sample_map()
+    data["items"].pop() # MapState only places items on whole hexes
+    state = MapState()
+    state.load_from_dict(data)
+    for name in ("map.json", "map.lmap"):
+        path = str(tmp_path / name)
+        state.save_to_file(path)
+        assert map_format.is_binary_map(path) == name.endswith(".lmap")
+        loaded = MapState()
+        loaded.load_from_file(path)
+        assert loaded.to_dict() == state.to_dict()
+
+
+def test_bad_files():
+    for data in (b"", b"LMA", b"JSON" + bytes(4)):
+        with pytest.raises(ValueError):
+            read_map(io.BytesIO(data))
+
+    f = io.BytesIO()
+    write_map(f, sample_map())
+    with pytest.raises(ValueError, match="Truncated"):
+        read_map(io.BytesIO(f.getvalue()[:-20]))
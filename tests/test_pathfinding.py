@@ -0,0 +1,108 @@
+from grid import hex_distance
+from map_state import MapState
+from pathfinding import MovementCache, find_path, reachable
+
+
+def make_map(*items):
+    state = MapState()
+    for path, q, r, fields in items:
+        state.add_item(path, q, r, "tile" if "tiles/" in path else "token")
+        if fields:
+            state.update_item(len(state.items) - 1, **fields)
+    return state
+
+
+def scout(q=0, r=0, speed=4, **fields):
+    return ("tokens/scout.png", q, r, dict(speed=speed, faction="Ally", **fields))
+
+
+def wall(q, r):
+    return ("tiles/wall.png", q, r, None)
+
+
+def test_open_ground():
+    state = make_map(scout())
+    costs = reachable(state, 0).costs
+    assert len(costs) == 3 * 4 * 5 + 1
+    assert all(d == hex_distance(0, 0, *h) for h, d in costs.items())
+    path, cost = find_path(state, 0, (3, -1))
+    assert cost == 3 and len(path) == 4
+    assert path[0] == (0, 0) and path[-1] == (3, -1)
+
+
+def test_speed_argument():
+    state = make_map(scout(speed=4))
+    assert len(reachable(state, 0, speed=1).costs) == 7
+    assert len(reachable(state, 0, speed=0).costs) == 1
+
+
+def test_wall_blocks():
+    # A wall from (2, -3) to (2, 3) with the scout in front of it
+    state = make_map(scout(speed=6), *[wall(2, r) for r in range(-3, 4)])
+    costs = reachable(state, 0).costs
+    assert not any((2, r) in costs for r in range(-3, 4))
+    assert (3, 0) not in costs
+
+    path, cost = find_path(state, 0, (3, 0))
+    assert cost > hex_distance(0, 0, 3, 0)
+    assert not any(h[0] == 2 and -3 <= h[1] <= 3 for h in path)
+    assert len(path) == cost + 1
+    assert find_path(state, 0, (2, 0)) == (None, None)
+
+
+def test_difficult_terrain():
+    state = make_map(scout(speed=3), ("tiles/water.png", 1, 0, None))
+    costs = reachable(state, 0).costs
+    assert costs[(1, 0)] == 2
+    assert find_path(state, 0, (1, 0)) == ([(0, 0), (1, 0)], 2)
+    # Wading through costs as much as going around
+    assert find_path(state, 0, (2, 0))[1] == 3
+    assert reachable(state, 0, speed=2).costs.get((2, 0)) is None
+
+
+def test_tokens_in_the_way():
+    state = make_map(
+        scout(speed=3),
+        ("tokens/friend.png", 1, 0, {"faction": "Ally"}),
+        ("tokens/enemy.png", 0, 1, {"faction": "Enemy"}),
+    )
+    costs = reachable(state, 0).costs
+    # Allies can be passed but not stopped on, enemies can't be entered
+    assert (1, 0) not in costs and (2, 0) in costs
+    assert (0, 1) not in costs
+    assert find_path(state, 0, (1, 0)) == (None, None)
+    assert find_path(state, 0, (2, 0)) == ([(0, 0), (1, 0), (2, 0)], 2)
+
+
+def test_large_token_needs_room():
+    # Size 2 doesn't fit through a one hex gap that a size 1 token walks through
+    walls = [wall(2, r) for r in range(-4, 5) if r != 0]
+    small = make_map(scout(speed=6), *walls)
+    assert find_path(small, 0, (4, 0))[0] is not None
+
+    big = make_map(scout(speed=6), *walls)
+    big.update_item(0, scale=2.0)
+    path, _ = find_path(big, 0, (4, 0), max_cost=6)
+    assert path is None
+
+
+def test_movement_cache():
+    state = make_map(scout(speed=3), ("tokens/other.png", 6, 0, {"speed": 3}))
+    cache = MovementCache(state)
+    first = cache.reachable(0)
+    assert cache.reachable(0) is first
+    other = cache.reachable(1)
+
+    # A wall next to the scout drops its range but not the far token's
+    state.add_item("tiles/wall.png", 1, 0, "tile")
+    second = cache.reachable(0)
+    assert second is not first and (1, 0) not in second.costs
+    assert cache.reachable(1) is other
+
+    # Moving a token next to the other one invalidates it
+    state.move_item(0, 4, 0)
+    assert cache.reachable(1) is not other
+    assert cache.reachable(1).costs == reachable(state, 1).costs
+
+    state.load_from_dict(state.to_dict())
+    assert cache.reachable(0).costs == reachable(state, 0).costs
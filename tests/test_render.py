@@ -0,0 +1,28 @@
+from PIL import Image
+
+from grid import HexGrid
+from map_state import MapState
+from render import map_bounds, render_map
+
+
+def test_render_token(tmp_path):
+    path = str(tmp_path / "token.png")
+    Image.new("RGBA", (20, 20), (255, 0, 0, 255)).save(path)
+    state = MapState()
+    state.grid_color = "#000000"
+    state.add_item(path, 0, 0)
+    grid = HexGrid(size=state.grid_size, flat_top=False)
+
+    rect = map_bounds(state, grid)
+    x0, y0, x1, y1 = rect
+    assert x0 < 0 < x1 and y0 < 0 < y1
+
+    img = render_map(state, grid, scale=0.5, rect=rect)
+    assert img.size == (round((x1 - x0) * 0.5), round((y1 - y0) * 0.5))
+    # The token is drawn centered on its hex
+    assert img.getpixel((round(-x0 * 0.5), round(-y0 * 0.5))) == (255, 0, 0, 255)
+
+
+def test_render_empty_map():
+    img = render_map(MapState(), scale=0.1)
+    assert img.width > 0 and img.height > 0
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+# Lives next to the global settings file
+THUMB_DIR = os.path.expanduser("~/.lancer_map_builder_thumbs")
+THUMB_SIZE = 250
+
+class ThumbnailCache:
+    """
+    Asset browser previews stored on disk, keyed by asset path and mtime.
+
+    Missing previews are generated on worker threads: `prefetch` fills the
+    cache in the background after a scan, `request` serves a preview the user
+    is waiting for ahead of that backlog. A new prefetch replaces the backlog
+    of the previous one. The backlog is handed to the pool a few paths at a
+    time, so a big library never means tens of thousands of queued futures.
+    """
+
+    def __init__(self, directory=THUMB_DIR, size=THUMB_SIZE, workers=4):
+        self.directory = directory
+        self.size = size
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.urgent = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        self.backlog = None # Iterator over the paths of the current prefetch left to submit
+        self.pending = set() # Futures of the current prefetch
+        os.makedirs(directory, exist_ok=True)
+
+    def thumb_path(self, path):
+        st = os.stat(path)
+        key = f"{path}|{st.st_mtime}|{st.st_size}|{self.size}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+    def get(self, path):
+        """
+        Returns the cached preview of `path`, or None if it wasn't generated yet.
+        """
+        try:
+            thumb_path = self.thumb_path(path)
+            if not os.path.exists(thumb_path):
+                return None
+            with Image.open(thumb_path) as f:
+                return f.copy()
+        except Exception:
+            return None
+
+    def generate(self, path):
+        """
+        Builds (or loads) the preview of `path` and returns it. Runs on a worker thread.
+        """
+        try:
+            thumb_path = self.thumb_path(path)
+            if os.path.exists(thumb_path):
+                with Image.open(thumb_path) as f:
+                    return f.copy()
+            return self.build(path, thumb_path)
+        except Exception as e:
+            print(f"Error generating preview for {path}: {e}")
+            return None
+
+    def ensure(self, path):
+        # Builds the preview of `path` if it isn't cached, without decoding cached ones
+        try:
+            thumb_path = self.thumb_path(path)
+            if not os.path.exists(thumb_path):
+                self.build(path, thumb_path)
+        except Exception as e:
+            print(f"Error generating preview for {path}: {e}")
+
+    def build(self, path, thumb_path):
+        with Image.open(path) as img:
+            # Resize for preview (max size x size)
+            w, h = img.size
+            ratio = min(self.size/w, self.size/h)
+            new_w, new_h = max(1, int(w*ratio)), max(1, int(h*ratio))
+            # JPEGs can be decoded straight at a reduced scale
+            img.draft(None, (new_w, new_h))
+            thumb = img.resize((new_w, new_h), Image.Resampling.NEAREST)
+
+        if thumb.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            thumb = thumb.convert("RGBA")
+        tmp = f"{thumb_path}.{os.getpid()}.{id(thumb)}.tmp"
+        thumb.save(tmp, format="PNG")
+        os.replace(tmp, thumb_path)
+        return thumb
+
+    def request(self, path):
+        # Future of the preview, ahead of any prefetch backlog
+        return self.urgent.submit(self.generate, path)
+
+    def prefetch(self, paths):
+        self.cancel_prefetch()
+        with self.lock:
+            self.backlog = iter(list(paths))
+        # Each finished preview submits the next one
+        for _ in range(self.workers * 2):
+            self._submit_next()
+
+    def _submit_next(self):
+        with self.lock:
+            if self.backlog is None:
+                return
+            path = next(self.backlog, None)
+            if path is None:
+                self.backlog = None
+                return
+            future = self.pool.submit(self.ensure, path)
+            self.pending.add(future)
+        future.add_done_callback(self._prefetched)
+
+    def _prefetched(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        if not future.cancelled():
+            self._submit_next()
+
+    def cancel_prefetch(self):
+        # Drops the previews that haven't been started yet
+        with self.lock:
+            self.backlog = None
+            pending, self.pending = self.pending, set()
+        for future in pending:
+            future.cancel()
+
+    def close(self):
+        # Doesn't wait for the queued previews, only the ones being built finish
+        self.cancel_prefetch()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.urgent.shutdown(wait=False, cancel_futures=True)